@@ -1,65 +1,310 @@
 import logging
 import time
 import click
-from booty.util import create_serial_port, create_blt, erase_device, load_hex, verify_hex
+from booty.util import create_serial_port, create_blt, erase_device, load_hex, verify_hex, parse_range, \
+    parse_patch, dump_flash, plan_writes, erase_and_load
+from booty.calibration import calibrate
+from booty.capture import CapturePort, ReplayPort
+from booty.journal import journaled_load
+from booty.server import create_server
+from booty.comm_thread import COMMAND_NAMES
+from booty.package import compile_package, load_package, profile_from_boot_loader, profile_from_processor, \
+    prepare_image, read_package, load_prepared
+from booty.timing import load_timing
+from booty.trace import Tracer
 from booty.version import __version__
 
 logger = logging.getLogger('booty')
 logging.basicConfig(level=logging.DEBUG)
 
 
-@click.command()
+def _parse_ranges(ctx, param, value):
+    try:
+        return [parse_range(v) for v in value]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _parse_patches(ctx, param, value):
+    try:
+        return dict(parse_patch(v) for v in value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@click.group(invoke_without_command=True)
 @click.option('--hexfile', '-h', help='The path to the hex file', type=click.Path())
 @click.option('--port', '-p', help='Serial port (COMx on Windows devices, ttyXX on Unix-like devices)')
 @click.option('--baudrate', '-b', default=115200, help='Baud rate in bits/s (defaults to 115200)')
+@click.option('--upshift', is_flag=True, help='Switch to the fastest baud rate supported by the device after identification')
 @click.option('--erase', '-e', is_flag=True, help='Erase the application space of the device')
+@click.option('--skip-blank', is_flag=True, help='Do not erase pages which are already blank')
+@click.option('--overlap', is_flag=True, help='With --erase and --load, erase each page while the rows of the '
+                                              'previous page are transmitted')
 @click.option('--load', '-l', is_flag=True, help='Load the device with the hex file')
 @click.option('--verify', '-v', is_flag=True, help='Verify device')
+@click.option('--dump', help='Read the flash of the device into a .hex or .bin file before any other operation',
+              type=click.Path())
+@click.option('--range', '-r', 'ranges', multiple=True, callback=_parse_ranges,
+              help='Only erase, load and verify the pages covering START:END (repeatable)')
+@click.option('--patch', 'patches', multiple=True, callback=_parse_patches,
+              help='Load the word VALUE at ADDRESS in place of the image contents, as ADDRESS=VALUE (repeatable)')
+@click.option('--package', help='Erase and load the device from a package created by "booty compile"',
+              type=click.Path(exists=True))
+@click.option('--journal', help='Erase and load using a progress journal in this directory, resuming interrupted loads',
+              type=click.Path(file_okay=False))
+@click.option('--max-batch', default=1, type=click.IntRange(min=1),
+              help='Transmit up to this many consecutive read frames together, for boot loaders which buffer '
+                   'incoming frames (defaults to 1)')
 @click.option('--version', '-V', is_flag=True, help='Show software version')
-def main(hexfile, port, baudrate, erase, load, verify, version):
+@click.option('--stats', is_flag=True, help='Dump session statistics as JSON at the end of the run')
+@click.option('--trace', help='Write a Chrome/Perfetto timeline of the session to this path', type=click.Path())
+@click.option('--capture', help='Record all serial traffic of the session to this path', type=click.Path())
+@click.option('--replay', help='Replay a captured session instead of opening a serial port', type=click.Path(exists=True))
+@click.option('--realtime', is_flag=True, help='Replay the captured session at the recorded speed')
+@click.pass_context
+def main(ctx, hexfile, port, baudrate, upshift, erase, skip_blank, overlap, load, verify, dump, ranges, patches, package, journal, max_batch, version, stats, trace, capture, replay, realtime):
+    if ctx.invoked_subcommand is not None:
+        return
+
     if version:
         logger.info('version {}'.format(__version__))
         return
 
-    if not erase and not load and not verify:
+    if not erase and not load and not verify and not package and not dump:
         logger.error('no operations specified - exiting')
         return
 
-    sp = create_serial_port(port, baudrate)
-    blt = create_blt(sp)
+    if package and ranges:
+        logger.error('address ranges cannot be applied to a package - exiting')
+        return
+
+    if patches and (ranges or journal):
+        logger.error('patches cannot be combined with address ranges or a journal - exiting')
+        return
+
+    tracer = Tracer() if trace else None
+
+    if replay:
+        sp = ReplayPort(replay, realtime=realtime)
+    else:
+        sp = create_serial_port(port, baudrate)
+
+    if capture:
+        sp = CapturePort(sp, capture)
+
+    blt = create_blt(sp, tracer=tracer, max_batch=max_batch)
 
     # allow time for threads and hardware to spin up
     time.sleep(0.1)
 
+    try:
+        if not blt.device_identified:
+            logger.error('device not responding')
+            return
+
+        if upshift:
+            blt.negotiate_baudrate()
+
+        result = True
+
+        if dump:
+            logger.info('dumping...')
+            result = dump_flash(blt, dump)
+            if result:
+                logger.info('device flash written to "{}"'.format(dump))
+            else:
+                logger.error('dump failed, no other operations performed')
+                return
+
+        if package and patches:
+            logger.info('loading from patched package...')
+            try:
+                image = read_package(package).patched(patches)
+            except ValueError as e:
+                logger.error('{} - exiting'.format(e))
+                return
+
+            result = load_prepared(blt, image)
+            if result:
+                logger.info('device successfully loaded!')
+            else:
+                logger.warning('device load failed')
+
+        elif package:
+            logger.info('loading from package...')
+            result = load_package(blt, package)
+            if result:
+                logger.info('device successfully loaded!')
+            else:
+                logger.warning('device load failed')
+
+        elif patches and load:
+            logger.info('loading patched image...')
+            try:
+                image = prepare_image(hexfile, profile_from_boot_loader(blt), blt.timing).patched(patches)
+            except ValueError as e:
+                logger.error('{} - exiting'.format(e))
+                return
+
+            result = load_prepared(blt, image, erase=erase)
+            if result:
+                logger.info('device successfully loaded!')
+            else:
+                logger.warning('device load failed')
+
+        elif journal and load:
+            logger.info('loading with journal...')
+            result = journaled_load(blt, hexfile, journal, ranges=ranges)
+            if result:
+                logger.info('device successfully loaded!')
+            else:
+                logger.warning('device load failed')
+
+        elif overlap and erase and load:
+            logger.info('erasing and loading...')
+            result = erase_and_load(blt, hexfile, ranges=ranges, skip_blank=skip_blank)
+            if result:
+                logger.info('device successfully erased and loaded!')
+            else:
+                logger.warning('device erase and load failed')
+
+        else:
+            if erase:
+                logger.info('erasing the device...')
+                result = erase_device(blt, ranges=ranges, skip_blank=skip_blank)
+                if result:
+                    logger.info('device successfully erased!')
+                else:
+                    logger.warning('device erase failed')
+
+            if load:
+                logger.info('loading...')
+                result = load_hex(blt, hexfile, ranges=ranges)
+                if result:
+                    logger.info('device successfully loaded!')
+                else:
+                    logger.warning('device load failed')
+
+        if verify and result:
+            logger.info('verifying...')
+            result = verify_hex(blt, hexfile, ranges=ranges, overrides=patches)
+            if result:
+                logger.info('device verified!')
+            else:
+                logger.warning('device verification failed')
+
+    finally:
+        if stats:
+            click.echo(blt.stats.to_json())
+
+        if tracer:
+            tracer.write(trace)
+            logger.info('trace written to "{}"'.format(trace))
+
+        if capture:
+            sp.close()
+            logger.info('capture written to "{}"'.format(capture))
+
+
+@main.command(name='compile')
+@click.option('--hexfile', '-h', required=True, help='The path to the hex file', type=click.Path(exists=True))
+@click.option('--output', '-o', required=True, help='The path of the package to create', type=click.Path())
+@click.option('--processor', help='Processor profile from booty.processors, used instead of a live device')
+@click.option('--port', '-p', help='Serial port of a device to identify when no processor is given')
+@click.option('--baudrate', '-b', default=115200, help='Baud rate in bits/s (defaults to 115200)')
+def compile_command(hexfile, output, processor, port, baudrate):
+    """
+    Compile a hex file into a package of pre-framed commands
+    """
+    if processor:
+        profile = profile_from_processor(processor)
+
+    elif port:
+        blt = create_blt(create_serial_port(port, baudrate))
+        if not blt.device_identified:
+            logger.error('device not responding')
+            return
+
+        profile = profile_from_boot_loader(blt)
+        blt.end_thread()
+
+    else:
+        logger.error('either a processor or a port must be specified - exiting')
+        return
+
+    # use the calibrated timing of the platform, when there is one
+    compile_package(hexfile, profile, output, timing=load_timing(profile.platform))
+
+
+@main.command(name='plan')
+@click.option('--hexfile', '-h', required=True, help='The path to the hex file', type=click.Path(exists=True))
+@click.option('--processor', required=True, help='Processor profile from booty.processors')
+@click.option('--baudrate', '-b', default=115200, help='Baud rate in bits/s to estimate for (defaults to 115200)')
+@click.option('--range', '-r', 'ranges', multiple=True, callback=_parse_ranges,
+              help='Only plan the pages covering START:END (repeatable)')
+@click.option('--list', 'list_writes', is_flag=True, help='List every planned write')
+def plan_command(hexfile, processor, baudrate, ranges, list_writes):
+    """
+    Show the commands chosen to write a hex file and their estimated time
+    """
+    try:
+        profile = profile_from_processor(processor)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    plan = plan_writes(profile, hexfile, baudrate, timing=load_timing(profile.platform), ranges=ranges)
+
+    if list_writes:
+        for command, address, opcodes, cost in plan:
+            logger.info('{:06X} {:9} {:4} opcodes {:.4f}s'.format(address, COMMAND_NAMES[command], len(opcodes), cost))
+
+    logger.info('plan: {}'.format(plan))
+
+
+@main.command(name='calibrate')
+@click.option('--port', '-p', required=True, help='Serial port of the device to calibrate')
+@click.option('--baudrate', '-b', default=115200, help='Baud rate in bits/s (defaults to 115200)')
+@click.option('--scratch', help='Address of an application page which may be erased and written, '
+                                'required to calibrate the erase and write delays')
+@click.option('--margin', default=1.5, help='Factor applied to the shortest working delay (defaults to 1.5)')
+def calibrate_command(port, baudrate, scratch, margin):
+    """
+    Measure the shortest safe delay of each command and save them for the platform
+    """
+    blt = create_blt(create_serial_port(port, baudrate))
     if not blt.device_identified:
         logger.error('device not responding')
         return
 
-    if erase:
-        logger.info('erasing the device...')
-        result = erase_device(blt)
-        if result:
-            logger.info('device successfully erased!')
-        else:
-            logger.warning('device erase failed')
+    try:
+        scratch_address = int(scratch, 0) if scratch else None
+        profile = calibrate(blt, scratch_address=scratch_address, margin=margin)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    finally:
+        blt.end_thread()
 
-    if load:
-        logger.info('loading...')
-        result = load_hex(blt, hexfile)
-        if result:
-            logger.info('device successfully loaded!')
-        else:
-            logger.warning('device load failed')
-    else:
-        result = True
+    logger.info('calibrated timing: {}'.format(profile))
 
-    if verify and result:
-        logger.info('verifying...')
-        result = verify_hex(blt, hexfile)
-        if result:
-            logger.info('device verified!')
-        else:
-            logger.warning('device verification failed')
+
+@main.command(name='serve')
+@click.option('--host', default='127.0.0.1', help='Address to listen on (defaults to 127.0.0.1)')
+@click.option('--http-port', default=7878, help='TCP port to listen on (defaults to 7878)')
+def serve_command(host, http_port):
+    """
+    Run a flashing daemon which accepts jobs over HTTP
+    """
+    httpd = create_server(host, http_port)
+    logger.info('serving on http://{}:{}'.format(host, http_port))
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.flash_server.shutdown()
+        httpd.server_close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,236 @@
+import logging
+import time
+
+from booty.timing import TimingProfile, DEFAULT_TIMING_DIRECTORY, save_timing
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def _settle(boot_loader_app, settle_time):
+    """
+    Wait for the transmit queue to empty and for the last responses to arrive
+    """
+    while boot_loader_app.busy and not boot_loader_app.end:
+        time.sleep(0.01)
+    time.sleep(settle_time)
+
+
+def _read_back(boot_loader_app, addresses, settle_time):
+    """
+    Reads rows of ``max_prog_size`` opcodes, queued back-to-back
+    :return: a dict of address to list of opcodes, or None if any row was not received
+    """
+    boot_loader_app.clear_memory_map()
+    for address in addresses:
+        boot_loader_app.read_page(address)
+    _settle(boot_loader_app, settle_time)
+
+    rows = {}
+    for address in addresses:
+        row = [boot_loader_app.get_opcode(address + 2 * i) for i in range(boot_loader_app.max_prog_size)]
+        if None in row:
+            return None
+        rows[address] = [opcode & 0xffffff for opcode in row]
+
+    return rows
+
+
+def _pattern(address, count, seed):
+    return [(address + 2 * i + seed * 0x10101) & 0xffffff for i in range(count)]
+
+
+class _Calibration:
+    """
+    The state shared by the probes of a calibration run.  Each probe issues a
+    burst of commands using the delay under test for one command and the
+    default delays for everything else, then checks the result at the default
+    delays.
+    """
+    def __init__(self, boot_loader_app, scratch_address, settle_time):
+        self.blt = boot_loader_app
+        self.scratch_address = scratch_address
+        self.settle_time = settle_time
+        self.defaults = TimingProfile(boot_loader_app.platform)
+        self.seed = 0
+
+        # enough reads to fill any receive buffer of the device, so that the sustained rate is measured
+        row_size = boot_loader_app.max_prog_size << 1
+        self.read_addresses = [address for address in range(boot_loader_app.app_start_addr,
+                                                             boot_loader_app.app_start_addr + 32 * row_size, row_size)
+                               if address < boot_loader_app.prog_length]
+        self.reference = None
+
+        if scratch_address is not None:
+            self.scratch_rows = [scratch_address + i * (boot_loader_app.max_prog_size << 1)
+                                 for i in range(boot_loader_app.page_length // boot_loader_app.max_prog_size)]
+
+    def identify(self):
+        self.blt.timing = self.defaults
+        self.blt.reset_identification()
+        self.blt.query_device()
+        _settle(self.blt, self.settle_time)
+        return self.blt.device_identified
+
+    def probe_query(self, timing):
+        self.blt.timing = timing
+        self.blt.reset_identification()
+        self.blt.query_device()
+        _settle(self.blt, self.settle_time)
+        identified = self.blt.device_identified
+
+        # leave the device identified for the probes which follow
+        if not identified and not self.identify():
+            raise IOError('device not responding at the default timing')
+
+        return identified
+
+    def probe_read_page(self, timing):
+        if self.reference is None:
+            self.blt.timing = self.defaults
+            self.reference = _read_back(self.blt, self.read_addresses, self.settle_time)
+            if self.reference is None:
+                raise IOError('could not read the device at the default timing')
+
+        self.blt.timing = timing
+        return _read_back(self.blt, self.read_addresses, self.settle_time) == self.reference
+
+    def _fill_scratch_page(self, timing):
+        self.seed += 1
+        expected = {}
+
+        self.blt.timing = self.defaults
+        self.blt.erase_page(self.scratch_address)
+
+        self.blt.timing = timing
+        for address in self.scratch_rows:
+            expected[address] = _pattern(address, self.blt.max_prog_size, self.seed)
+            self.blt.write_max(address, expected[address])
+
+        return expected
+
+    def probe_write_max(self, timing):
+        expected = self._fill_scratch_page(timing)
+
+        self.blt.timing = self.defaults
+        return _read_back(self.blt, self.scratch_rows, self.settle_time) == expected
+
+    def probe_write_row(self, timing):
+        self.seed += 1
+        address = self.scratch_rows[0]
+        expected = _pattern(address, self.blt.max_prog_size, self.seed)
+
+        self.blt.timing = self.defaults
+        self.blt.erase_page(self.scratch_address)
+
+        self.blt.timing = timing
+        for i in range(0, self.blt.max_prog_size, self.blt.row_length):
+            self.blt.write_row(address + i * 2, expected[i:i + self.blt.row_length])
+
+        self.blt.timing = self.defaults
+        rows = _read_back(self.blt, [address], self.settle_time)
+        return rows is not None and rows[address] == expected
+
+    def probe_erase_page(self, timing):
+        self._fill_scratch_page(self.defaults)
+
+        self.blt.timing = timing
+        self.blt.erase_page(self.scratch_address)
+
+        # the reads follow the erase immediately, so they are lost if the erase is still in progress
+        self.blt.timing = self.defaults
+        blank = [0xffffff] * self.blt.max_prog_size
+        rows = _read_back(self.blt, self.scratch_rows, self.settle_time)
+        return rows is not None and all(row == blank for row in rows.values())
+
+
+def _shortest_delay(calibration, command, probe, trials, factor, max_steps):
+    """
+    Shrinks the delay of a command geometrically until the probe fails
+    :return: the smallest fraction of the default delay which passed every trial
+    """
+    defaults = calibration.defaults
+
+    if not all(probe(defaults) for _ in range(trials)):
+        logger.error('{} failed at the default delay, keeping the default'.format(command))
+        return 1.0
+
+    passed = 1.0
+    for _ in range(max_steps):
+        candidate = passed * factor
+        timing = defaults.scaled(command, candidate)
+        if not all(probe(timing) for _ in range(trials)):
+            logger.info('{} failed at {:.6f}s'.format(command, timing.delay(command, calibration.blt.baudrate)))
+            break
+
+        passed = candidate
+
+    return passed
+
+
+def calibrate(boot_loader_app, scratch_address=None, margin=1.5, factor=0.7, trials=3, max_steps=12,
+              settle_time=0.2, directory=DEFAULT_TIMING_DIRECTORY):
+    """
+    Finds the shortest safe delay for each command of the identified device.
+    The delay of each command is shrunk until the device no longer returns the
+    expected data, and the last delay which worked is multiplied by the margin.
+    Delays are never made longer than the defaults.  The resulting profile is
+    saved for the platform and used by the boot loader from then on.
+
+    The identification queries and page reads are always calibrated.  Erase and
+    write delays are only calibrated when a scratch page in the application
+    space is given, as that page is erased and written repeatedly.  The single
+    address read keeps its default delay.
+    :param boot_loader_app: the identified boot loader
+    :param scratch_address: the address of a page which may be erased and written
+    :param margin: the factor applied to the shortest working delay
+    :param factor: the factor by which the delay is shrunk at each step
+    :param trials: the number of times each delay must work
+    :param max_steps: the maximum number of times each delay is shrunk
+    :param settle_time: the time allowed for responses after each burst, in seconds
+    :param directory: the directory in which timing profiles are kept, or None to not save the profile
+    :return: the ``TimingProfile``
+    """
+    if scratch_address is not None:
+        page_size = boot_loader_app.page_length << 1
+        if scratch_address % page_size or \
+                not boot_loader_app.app_start_addr <= scratch_address < boot_loader_app.prog_length:
+            raise ValueError('scratch address {:06X} must be the start of a page in the application space'.format(
+                scratch_address))
+
+    calibration = _Calibration(boot_loader_app, scratch_address, settle_time)
+
+    probes = [('query', calibration.probe_query), ('read_page', calibration.probe_read_page)]
+    if scratch_address is not None:
+        probes += [('write_max', calibration.probe_write_max),
+                   ('write_row', calibration.probe_write_row),
+                   ('erase_page', calibration.probe_erase_page)]
+
+    # a profile saved while calibrating must not replace the one under test
+    timing_directory = boot_loader_app.timing_directory
+    boot_loader_app.timing_directory = None
+
+    profile = calibration.defaults
+    try:
+        for command, probe in probes:
+            logger.info('calibrating {}...'.format(command))
+            fraction = min(1.0, _shortest_delay(calibration, command, probe, trials, factor, max_steps) * margin)
+            profile = profile.scaled(command, fraction)
+            logger.info('{} delay: {:.6f}s (default {:.6f}s)'.format(
+                command, profile.delay(command, boot_loader_app.baudrate),
+                calibration.defaults.delay(command, boot_loader_app.baudrate)))
+
+        if scratch_address is not None:
+            boot_loader_app.timing = calibration.defaults
+            boot_loader_app.erase_page(scratch_address)
+            _settle(boot_loader_app, settle_time)
+
+    finally:
+        boot_loader_app.timing = profile
+        boot_loader_app.timing_directory = timing_directory
+
+    if directory is not None:
+        path = save_timing(profile, directory)
+        logger.info('timing profile saved to "{}"'.format(path))
+
+    return profile
@@ -0,0 +1,172 @@
+import logging
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_MAGIC = b'BOOTYCAP'
+_FORMAT_VERSION = 1
+
+# magic, format version, baud rate
+_HEADER = struct.Struct('<8sBI')
+
+# direction, seconds since the start of the capture, length of the data which follows
+_RECORD = struct.Struct('<cdI')
+
+WRITE = b'W'
+READ = b'R'
+
+
+class CapturePort:
+    """
+    Wraps a serial port and logs every write and read to a compact binary
+    file along with a monotonic timestamp.  All other attributes are
+    forwarded to the wrapped port, so an instance may be passed to the
+    ``Framer`` in place of the port itself.
+    """
+    def __init__(self, port, path):
+        self._port = port
+        self._file = open(path, 'wb')
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+
+        self._file.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, int(port.baudrate)))
+
+    def __getattr__(self, item):
+        return getattr(self._port, item)
+
+    @property
+    def baudrate(self):
+        return self._port.baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self._port.baudrate = baudrate
+
+    def _record(self, direction, data):
+        if not data or self._file.closed:
+            return
+
+        with self._lock:
+            self._file.write(_RECORD.pack(direction, time.monotonic() - self._start_time, len(data)))
+            self._file.write(bytes(data))
+
+    @property
+    def in_waiting(self):
+        return self._port.in_waiting
+
+    def write(self, data):
+        result = self._port.write(data)
+        self._record(WRITE, data)
+        return result
+
+    def read(self, size=1):
+        data = self._port.read(size)
+        self._record(READ, data)
+        return data
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """
+    Read a capture file
+    :param path: the path to the capture file
+    :return: a tuple containing the baud rate and a list of (direction, timestamp, data) records
+    """
+    with open(path, 'rb') as f:
+        contents = f.read()
+
+    magic, version, baudrate = _HEADER.unpack_from(contents)
+    if magic != _MAGIC or version != _FORMAT_VERSION:
+        raise ValueError('"{}" is not a supported capture file'.format(path))
+
+    records = []
+    offset = _HEADER.size
+    while offset < len(contents):
+        direction, timestamp, length = _RECORD.unpack_from(contents, offset)
+        offset += _RECORD.size
+        records.append((direction, timestamp, contents[offset:offset + length]))
+        offset += length
+
+    return baudrate, records
+
+
+class ReplayPort:
+    """
+    Port which plays a captured session back to the ``Framer``.
+
+    Received data is released once the host has written everything that
+    preceded it in the capture.  When ``realtime`` is set, data is also held
+    back until the recorded delay since the preceding write has elapsed;
+    otherwise it is released as fast as the host consumes it.
+    """
+    def __init__(self, path, realtime=False):
+        self.baudrate, self._records = read_capture(path)
+        self._realtime = realtime
+
+        self._index = 0
+        self._written = 0           # bytes written by the host which are not yet matched to a record
+        self._last_write_time = None
+        self._last_write_record_time = None
+        self._available = bytearray()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        """
+        True when every record of the capture has been replayed and read
+        """
+        return self._index >= len(self._records) and len(self._available) == 0
+
+    def _advance(self):
+        while self._index < len(self._records):
+            direction, timestamp, data = self._records[self._index]
+
+            if direction == WRITE:
+                if self._written < len(data):
+                    return
+                self._written -= len(data)
+                self._last_write_record_time = timestamp
+                self._last_write_time = time.monotonic()
+
+            else:
+                if self._realtime and self._last_write_record_time is not None:
+                    due = self._last_write_time + (timestamp - self._last_write_record_time)
+                    if time.monotonic() < due:
+                        return
+
+                self._available += data
+
+            self._index += 1
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._advance()
+            return len(self._available)
+
+    def read(self, size=1):
+        with self._lock:
+            self._advance()
+            data = bytes(self._available[:size])
+            del self._available[:size]
+            return data
+
+    def write(self, data):
+        with self._lock:
+            self._written += len(data)
+            self._advance()
+
+            if self._index >= len(self._records) and self._written > 0:
+                logger.warning('host wrote {} bytes beyond the end of the capture'.format(self._written))
+                self._written = 0
+
+        return len(data)
+
+    def close(self):
+        pass
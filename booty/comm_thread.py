@@ -1,9 +1,15 @@
+import collections
 import logging
+import struct
 import threading
 import time
 
 import serial
 from booty.framer import Framer
+from booty.mirror import FlashMirror
+from booty.stats import Stats
+from booty.timing import TimingProfile, DEFAULT_TIMING_DIRECTORY, load_timing
+from booty.trace import Tracer
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -16,8 +22,11 @@ READ_PROG_LEN = 0x04
 READ_MAX_PROG_SIZE = 0x05
 READ_APP_START_ADDRESS = 0x06
 READ_BOOT_START_ADDRESS = 0x07
+READ_BAUD_RATES = 0x08
+SET_BAUD_RATE = 0x09
 
 ERASE_PAGE = 0x10
+BLANK_CHECK = 0x11
 
 READ_ADDR = 0x20
 READ_MAX = 0x21
@@ -27,15 +36,112 @@ WRITE_MAX = 0x31
 
 START_APP = 0x40
 
+COMMAND_NAMES = {
+    READ_PLATFORM: 'READ_PLATFORM',
+    READ_VERSION: 'READ_VERSION',
+    READ_ROW_LEN: 'READ_ROW_LEN',
+    READ_PAGE_LEN: 'READ_PAGE_LEN',
+    READ_PROG_LEN: 'READ_PROG_LEN',
+    READ_MAX_PROG_SIZE: 'READ_MAX_PROG_SIZE',
+    READ_APP_START_ADDRESS: 'READ_APP_START_ADDRESS',
+    READ_BOOT_START_ADDRESS: 'READ_BOOT_START_ADDRESS',
+    READ_BAUD_RATES: 'READ_BAUD_RATES',
+    SET_BAUD_RATE: 'SET_BAUD_RATE',
+    ERASE_PAGE: 'ERASE_PAGE',
+    BLANK_CHECK: 'BLANK_CHECK',
+    READ_ADDR: 'READ_ADDR',
+    READ_MAX: 'READ_MAX',
+    WRITE_ROW: 'WRITE_ROW',
+    WRITE_MAX: 'WRITE_MAX',
+    START_APP: 'START_APP'
+}
+
+# commands which the device answers with a response carrying the same command code
+RESPONSE_COMMANDS = (
+    READ_PLATFORM, READ_VERSION, READ_ROW_LEN, READ_PAGE_LEN, READ_PROG_LEN,
+    READ_MAX_PROG_SIZE, READ_APP_START_ADDRESS, READ_BOOT_START_ADDRESS,
+    READ_BAUD_RATES, SET_BAUD_RATE, BLANK_CHECK, READ_ADDR, READ_MAX
+)
+
+# commands which only read from the device and may be transmitted back-to-back
+BATCHABLE_COMMANDS = tuple(c for c in RESPONSE_COMMANDS if c != SET_BAUD_RATE)
+
+# the rates tried when negotiating a faster baud rate, fastest first
+BAUD_RATES = (921600, 460800, 230400, 115200)
+
+# time after a baud rate change within which the device expects a valid frame
+# at the new rate, after which it returns to the previous rate
+BAUD_RATE_REVERT_TIME = 0.5
+
+# responses not received within this time after their command, in seconds, are counted as timeouts
+RESPONSE_TIMEOUT = 1.0
+
+# interval at which responses are parsed while waiting after a transmission, in seconds, which bounds the
+# resolution of the round-trip times
+RESPONSE_POLL_INTERVAL = 0.001
+
+# commands whose responses repeat the address of the command, so that each is matched to its own command
+ADDRESSED_COMMANDS = (BLANK_CHECK, READ_ADDR, READ_MAX)
+
+# the most pages covered by a single ``BLANK_CHECK``, which keeps the response bitmap to 4 bytes
+BLANK_CHECK_MAX_PAGES = 32
+
+
+def address_command(command, address):
+    """
+    Builds the payload of a command which consists of the command code and an address
+    :param command: the command code
+    :param address: the address
+    :return: the payload as bytes
+    """
+    return struct.pack('<BI', command, address & 0xffffffff)
+
+
+def write_row_command(address, data):
+    """
+    Builds the payload of a ``WRITE_ROW`` command
+    :param address: the address of the first opcode
+    :param data: the opcodes of the row
+    :return: the payload as bytes
+    """
+    return struct.pack('<BI{}I'.format(len(data)), WRITE_ROW, address & 0xffffffff,
+                       *[d & 0xffffffff for d in data])
+
+
+def write_max_command(address, data, max_prog_size):
+    """
+    Builds the payload of a ``WRITE_MAX`` command, padding the data with 0xffffff
+    :param address: the address of the first opcode
+    :param data: the opcodes, no more than ``max_prog_size``
+    :param max_prog_size: the maximum programming size of the device
+    :return: the payload as bytes
+    """
+    if len(data) > max_prog_size:
+        raise ValueError('data width exceeds the maximum programming size')
+
+    prog_map = [d & 0xffffffff for d in data] + [0xffffff] * (max_prog_size - len(data))
+
+    return struct.pack('<BI{}I'.format(max_prog_size), WRITE_MAX, address & 0xffffffff, *prog_map)
+
 
 class BootLoaderThread:
 
-    def __init__(self, port, timeout=0.01, threaded=True):
-        self._framer = Framer(port=port, threaded=False)
+    def __init__(self, port, timeout=0.01, threaded=True, stats=None, tracer=None, max_batch=1,
+                 timing=None, timing_directory=DEFAULT_TIMING_DIRECTORY):
+        self.max_batch = max_batch
+        self.timing = timing if timing is not None else TimingProfile()
+        self.timing_directory = timing_directory if timing is None else None
+        self.stats = stats if stats is not None else Stats()
+        self.tracer = tracer if tracer is not None else Tracer(enabled=False)
+
+        self._framer = Framer(port=port, threaded=False, stats=self.stats)
         self._timeout = timeout
         self._threaded = threaded
 
-        self.transmit_queue = []
+        self.transmit_queue = collections.deque()
+        self._in_flight = False
+        # (command, address) to the times at which the commands awaiting a response were sent
+        self._pending_responses = {}
 
         self.platform = None
         self.version = None
@@ -48,10 +154,24 @@ class BootLoaderThread:
 
         self.device_identified = False
 
-        self.local_memory_map = []
+        self.baud_rates = None
+        self._baud_rate_ack = None
+
+        # page address to True if the device reported the page as blank, filled by ``BLANK_CHECK`` responses
+        self.blank_check_results = {}
+        self.blank_check_supported = None
+
+        # what is known of the flash of the device, from reads, erases and writes
+        self.mirror = FlashMirror()
+
+        # called on the boot loader thread with the address and the opcodes of each read response
+        self.read_handler = None
 
         self.end = False
 
+        # the exception which stopped the boot loader thread, such as a lost serial port
+        self.error = None
+
         if self._threaded:
             self._runner = threading.Thread(target=self.run, daemon=True)
             self._runner.start()
@@ -66,11 +186,32 @@ class BootLoaderThread:
 
     @property
     def busy(self):
-        if len(self.transmit_queue) > 0:
+        if self.error is not None:
+            return False
+
+        if len(self.transmit_queue) > 0 or self._in_flight:
             return True
         else:
             return False
 
+    @property
+    def alive(self):
+        """
+        :return: True while the boot loader thread is able to transmit
+        """
+        if self.end or self.error is not None:
+            return False
+
+        return not self._threaded or self._runner.is_alive()
+
+    @property
+    def port(self):
+        return self._framer._port
+
+    @property
+    def baudrate(self):
+        return self._framer._port.baudrate
+
     @property
     def transactions_remaining(self):
         return len(self.transmit_queue)
@@ -85,19 +226,153 @@ class BootLoaderThread:
         self.end = True
         logger.info('ending bootloader interface thread...')
 
-    def add_to_queue(self, action, time_to_wait):
+    def add_to_queue(self, action, time_to_wait, callback=None, address=None, opcodes=None):
+        """
+        Frame an action and add it to the transmit queue.  Framing happens on the
+        calling thread so that it overlaps with the transmission of earlier actions.
+        :param action: the command, either as a single byte or as a sequence of bytes
+        :param time_to_wait: the time to wait after transmission, in seconds
+        :param callback: called without arguments on the boot loader thread once the action
+            has been transmitted and its wait has elapsed
+        :param address: the flash address that the action refers to, if any
+        :param opcodes: the opcodes written by a write action, if known
+        :return: None
+        """
+        command = action if isinstance(action, int) else action[0]
+        self.add_frame_to_queue(command, self._framer.encode(action), time_to_wait, callback, address, opcodes)
+
+    def add_frame_to_queue(self, command, frame, time_to_wait, callback=None, address=None, opcodes=None):
+        """
+        Add a frame which has already been encoded to the transmit queue.  The
+        address and opcodes of erases and writes are recorded in the mirror once
+        the frame has been transmitted and its wait has elapsed; a write without
+        opcodes makes the contents at its address unknown.
+        :param command: the command code contained within the frame
+        :param frame: the encoded frame
+        :param time_to_wait: the time to wait after transmission, in seconds
+        :param callback: called once the frame has been transmitted and its wait has elapsed
+        :param address: the flash address that the frame refers to, if any
+        :param opcodes: the opcodes written by a write frame, if known
+        :return: None
+        """
         logger.debug('current queue length: {} adding to tx queue'.format(len(self.transmit_queue)))
         self.transmit_queue.append(
-            (action, time_to_wait)
+            (command, frame, time_to_wait, time.perf_counter(), callback, address, opcodes)
         )
 
+    def wait_for_queue_space(self, max_length):
+        """
+        Block until fewer than ``max_length`` actions are waiting to be transmitted,
+        which allows a producer to keep the transmit queue bounded
+        :param max_length: the maximum number of queued actions
+        :return: None
+        """
+        while len(self.transmit_queue) >= max_length and self.alive:
+            time.sleep(self._timeout)
+
     def service_tx_queue(self):
+        """
+        Transmit the next action in the queue and wait for the time requested by the action.
+        Consecutive actions which only read from the device are sent together as a single
+        write, followed by the combined wait of the batch.
+        :return: the time spent waiting, in seconds
+        """
         if len(self.transmit_queue) > 0:
-            action, time_to_wait = self.transmit_queue.pop(0)
-            logger.debug('transmitting... {} actions remaining'.format(len(self.transmit_queue)))
-            self._framer.tx(action)
+            # the batch remains busy until its wait has elapsed and its callbacks have run
+            self._in_flight = True
+            batch = [self.transmit_queue.popleft()]
+            if batch[0][0] in BATCHABLE_COMMANDS:
+                while len(batch) < self.max_batch and len(self.transmit_queue) > 0 \
+                        and self.transmit_queue[0][0] in BATCHABLE_COMMANDS:
+                    batch.append(self.transmit_queue.popleft())
+
+            logger.debug('transmitting {}... {} actions remaining'.format(len(batch), len(self.transmit_queue)))
+
+            names = [COMMAND_NAMES.get(command, hex(command)) for command, _, _, _, _, _, _ in batch]
+            for name, (_, _, _, enqueued_at, _, _, _) in zip(names, batch):
+                self.tracer.complete('queued', enqueued_at, command=name)
+
+            with self.tracer.span('transmit', command=', '.join(names), frames=len(batch)):
+                if len(batch) == 1:
+                    self._framer.tx_frame(batch[0][1])
+                else:
+                    self._framer.tx_frames([frame for _, frame, _, _, _, _, _ in batch])
 
-            time.sleep(time_to_wait)
+            sent_at = time.perf_counter()
+            for command, _, _, _, _, address, _ in batch:
+                if command in RESPONSE_COMMANDS:
+                    key = (command, address if command in ADDRESSED_COMMANDS else None)
+                    self._pending_responses.setdefault(key, []).append(sent_at)
+
+            start_time = time.perf_counter()
+            self._wait(sum(time_to_wait for _, _, time_to_wait, _, _, _, _ in batch))
+            waited = time.perf_counter() - start_time
+            self.stats.add_time('tx_wait', waited)
+            self.tracer.complete('sleep', start_time, command=', '.join(names))
+
+            for command, _, _, _, _, address, opcodes in batch:
+                if command in (ERASE_PAGE, WRITE_ROW, WRITE_MAX):
+                    self._update_mirror(command, address, opcodes)
+
+            for _, _, _, _, callback, _, _ in batch:
+                if callback is not None:
+                    callback()
+
+            self._in_flight = False
+
+            return waited
+
+        return 0.0
+
+    def _wait(self, seconds):
+        """
+        Waits after a transmission, parsing responses as they arrive so that their
+        round-trip times are not lengthened by the remainder of the wait
+        :param seconds: the time to wait
+        :return: None
+        """
+        deadline = time.perf_counter() + seconds
+        while True:
+            self.parse_messages()
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, RESPONSE_POLL_INTERVAL))
+
+    def _update_mirror(self, command, address, opcodes):
+        """
+        Records an erase or write which has been transmitted and waited for in the mirror
+        """
+        if address is None or not self.page_length:
+            # nothing is known of what changed
+            self.mirror.clear()
+
+        elif command == ERASE_PAGE:
+            page_size = self.page_length << 1
+            self.mirror.erased(address - address % page_size, self.page_length)
+
+        elif opcodes is None:
+            self.mirror.forget(address, self.row_length if command == WRITE_ROW else self.max_prog_size)
+
+        else:
+            self.mirror.written(address, opcodes)
+
+    def _expire_responses(self):
+        """
+        Forget the commands which have waited longer than ``RESPONSE_TIMEOUT`` for
+        a response, counting each as a timeout, so that lost responses and
+        commands which the device does not support are not waited for forever
+        """
+        expired_before = time.perf_counter() - RESPONSE_TIMEOUT
+        for key in list(self._pending_responses):
+            sent = self._pending_responses[key]
+            while sent and sent[0] < expired_before:
+                sent.pop(0)
+                self.stats.add_timeout(key[0])
+
+            if not sent:
+                del self._pending_responses[key]
 
     def parse_messages(self):
         messages = []
@@ -105,7 +380,10 @@ class BootLoaderThread:
             messages.append(self._framer.rx())
 
         for message in messages:
-            self._parse_message(message)
+            with self.tracer.span('parse', command=COMMAND_NAMES.get(message[0], hex(message[0]))):
+                self._parse_message(message)
+
+        self._expire_responses()
 
         if not self.device_identified:
             if self.platform is not None \
@@ -119,8 +397,25 @@ class BootLoaderThread:
                 self.device_identified = True
                 logger.info('device identification complete')
 
+                if self.timing_directory is not None:
+                    timing = load_timing(self.platform, self.timing_directory)
+                    if timing is not None:
+                        self.timing = timing
+                        logger.info('using calibrated timing for {}'.format(self.platform))
+
     def _parse_message(self, msg):
         command = msg[0]
+
+        address = None
+        if command in ADDRESSED_COMMANDS and len(msg) >= 5:
+            address, = struct.unpack_from('<I', bytes(msg), 1)
+
+        sent = self._pending_responses.get((command, address))
+        if sent:
+            sent_at = sent.pop(0)
+            self.stats.add_round_trip(command, time.perf_counter() - sent_at)
+            self.tracer.complete('response', sent_at, command=COMMAND_NAMES[command])
+
         if command == READ_PLATFORM:
             platform = ''
             for c in msg[1:]:
@@ -147,8 +442,6 @@ class BootLoaderThread:
             self.prog_length = msg[1] + (msg[2] << 8) + (msg[3] << 16) + (msg[4] << 24)
             logger.info('program length set: {}'.format(self.prog_length))
 
-            self.local_memory_map = [None] * (0x200 * self.prog_length >> 1)
-
         elif command == READ_MAX_PROG_SIZE:
             self.max_prog_size = msg[1] + (msg[2] << 8)
             logger.info('max programming size set: {}'.format(self.max_prog_size))
@@ -161,6 +454,21 @@ class BootLoaderThread:
             self.boot_start_addr = msg[1] + (msg[2] << 8)
             logger.info('bootloader start address set: {}'.format(self.boot_start_addr))
 
+        elif command == READ_BAUD_RATES:
+            self.baud_rates = list(struct.unpack('<{}I'.format((len(msg) - 1) // 4), bytes(msg[1:])))
+            logger.info('supported baud rates: {}'.format(self.baud_rates))
+
+        elif command == SET_BAUD_RATE:
+            self._baud_rate_ack, = struct.unpack_from('<I', bytes(msg), 1)
+
+        elif command == BLANK_CHECK:
+            self.blank_check_supported = True
+            address, pages = struct.unpack_from('<IH', bytes(msg), 1)
+            bitmap = msg[7:]
+            for i in range(pages):
+                page = address + i * (self.page_length << 1)
+                self.blank_check_results[page] = bool(bitmap[i >> 3] & (1 << (i & 7)))
+
         elif command == READ_ADDR or command == READ_MAX:
             mem = msg[1:]
             width_in_bytes = 4
@@ -178,17 +486,35 @@ class BootLoaderThread:
                 prog_mem.append(memory)
 
             address = prog_mem.pop(0)
+            self.mirror.filled(address, prog_mem)
+            logger.debug('read {} opcodes from {:06X}'.format(len(prog_mem), address))
 
-            for i, e in enumerate(prog_mem):
-                local_mem_index = (address >> 1) + i
-                if self.local_memory_map:
-                    self.local_memory_map[local_mem_index] = e
-
-                    logger.debug('local: {:06X}: {:06X}'.format(local_mem_index << 1, e))
+            if self.read_handler is not None:
+                self.read_handler(address, prog_mem)
 
         else:
             logger.warning('command not found: {}'.format(command))
 
+    def reset_identification(self):
+        """
+        Forget the identification of the device so that it may be identified again,
+        along with everything known of its flash, as another board may have been connected
+        :return: None
+        """
+        self.platform = None
+        self.version = None
+        self.row_length = None
+        self.page_length = None
+        self.prog_length = None
+        self.max_prog_size = None
+        self.app_start_addr = None
+        self.boot_start_addr = None
+
+        self.device_identified = False
+        self.blank_check_supported = None
+        self.blank_check_results = {}
+        self.mirror.clear()
+
     def query_device(self):
         self.query_platform()
 
@@ -201,76 +527,153 @@ class BootLoaderThread:
         self.query_boot_start_address()
 
     def query_platform(self):
-        self.add_to_queue(READ_PLATFORM, 0.01 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(READ_PLATFORM, self.timing.delay('query', self.baudrate))
 
     def query_version(self):
-        self.add_to_queue(READ_VERSION, 0.01 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(READ_VERSION, self.timing.delay('query', self.baudrate))
 
     def query_row_length(self):
-        self.add_to_queue(READ_ROW_LEN, 0.01 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(READ_ROW_LEN, self.timing.delay('query', self.baudrate))
 
     def query_page_length(self):
-        self.add_to_queue(READ_PAGE_LEN, 0.01 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(READ_PAGE_LEN, self.timing.delay('query', self.baudrate))
 
     def query_prog_length(self):
-        self.add_to_queue(READ_PROG_LEN, 0.01 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(READ_PROG_LEN, self.timing.delay('query', self.baudrate))
 
     def query_max_prog_size(self):
-        self.add_to_queue(READ_MAX_PROG_SIZE, 0.01 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(READ_MAX_PROG_SIZE, self.timing.delay('query', self.baudrate))
 
     def query_app_start_address(self):
-        self.add_to_queue(READ_APP_START_ADDRESS, 0.01 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(READ_APP_START_ADDRESS, self.timing.delay('query', self.baudrate))
 
     def query_boot_start_address(self):
-        self.add_to_queue(READ_BOOT_START_ADDRESS, 0.01 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(READ_BOOT_START_ADDRESS, self.timing.delay('query', self.baudrate))
 
-    def erase_page(self, address_start):
-        self.add_to_queue(
-            [
-                ERASE_PAGE,
-                (address_start & 0x000000ff),
-                (address_start & 0x0000ff00) >> 8,
-                (address_start & 0x00ff0000) >> 16,
-                (address_start & 0xff000000) >> 24,
-            ],
-            0.025
-        )
+    def query_baud_rates(self):
+        self.add_to_queue(READ_BAUD_RATES, self.timing.delay('query', self.baudrate))
+
+    def _wait_for(self, condition, timeout):
+        start_time = time.time()
+        while not condition():
+            if time.time() - start_time > timeout or self.end:
+                return False
+            time.sleep(0.01)
+
+        return True
+
+    def _check_link(self, timeout):
+        """
+        Checks that the device responds at the current baud rate
+        :return: True if the device responded, else False
+        """
+        version, self.version = self.version, None
+        self.query_version()
+        if self._wait_for(lambda: self.version is not None, timeout):
+            return True
+
+        self.version = version
+        return False
+
+    def _change_baudrate(self, baudrate, timeout):
+        """
+        Switches the device and then the port to another baud rate and checks
+        the link, returning to the previous rate if the check fails
+        :return: True if the device responds at the new rate, else False
+        """
+        previous = self.baudrate
+
+        self._baud_rate_ack = None
+        self.add_to_queue(struct.pack('<BI', SET_BAUD_RATE, baudrate), self.timing.delay('query', self.baudrate))
+        if not self._wait_for(lambda: self._baud_rate_ack == baudrate and not self.busy, timeout):
+            logger.info('device did not accept {} bits/s'.format(baudrate))
+            return False
+
+        self.port.baudrate = baudrate
+        if self._check_link(timeout):
+            return True
+
+        # the device returns to the previous rate when it does not receive a valid frame at the new rate
+        logger.warning('link check failed at {} bits/s, returning to {} bits/s'.format(baudrate, previous))
+        self.port.baudrate = previous
+        time.sleep(BAUD_RATE_REVERT_TIME)
+
+        if not self._check_link(timeout):
+            raise IOError('device not responding after returning to {} bits/s'.format(previous))
+
+        return False
+
+    def negotiate_baudrate(self, baud_rates=BAUD_RATES, timeout=0.3):
+        """
+        Switches to the fastest baud rate supported by both the device and the
+        host.  Each rate is tried from the fastest down and the link is checked
+        after each switch.  Devices which do not support ``READ_BAUD_RATES``
+        remain at the current rate.  Delays scale with the new rate.
+        :param baud_rates: the rates which the host supports
+        :param timeout: the time to wait for each response, in seconds
+        :return: the baud rate in use
+        """
+        self.baud_rates = None
+        self.query_baud_rates()
+        if not self._wait_for(lambda: self.baud_rates is not None, timeout):
+            logger.info('baud rate negotiation not supported, remaining at {} bits/s'.format(self.baudrate))
+            return self.baudrate
+
+        for baudrate in sorted(set(baud_rates) & set(self.baud_rates), reverse=True):
+            if baudrate <= self.baudrate:
+                break
+
+            if self._change_baudrate(baudrate, timeout):
+                logger.info('baud rate set to {} bits/s'.format(baudrate))
+                break
+
+        return self.baudrate
+
+    def erase_page(self, address_start, callback=None):
+        self.add_to_queue(address_command(ERASE_PAGE, address_start), self.timing.delay('erase_page', self.baudrate),
+                          callback, address=address_start)
 
         logger.debug('erasing page addresses {} to {}'.format(
             hex(address_start), hex(address_start + self.page_length * 2 - 1))
         )
 
+    def blank_check(self, address_start, pages=1):
+        """
+        Asks the device whether each of a run of pages is blank.  The response
+        is stored in ``blank_check_results``.  Devices which do not support
+        ``BLANK_CHECK`` do not respond.
+        :param address_start: the address of the first page
+        :param pages: the number of consecutive pages, no more than ``BLANK_CHECK_MAX_PAGES``
+        :return: None
+        """
+        if not 0 < pages <= BLANK_CHECK_MAX_PAGES:
+            raise ValueError('a blank check covers 1 to {} pages'.format(BLANK_CHECK_MAX_PAGES))
+
+        self.add_to_queue(
+            struct.pack('<BIH', BLANK_CHECK, address_start & 0xffffffff, pages),
+            self.timing.delay('query', self.baudrate) + self.timing.delay('blank_check', self.baudrate, pages),
+            address=address_start & 0xffffffff
+        )
+
     def read(self, address):
         address &= 0xfffffffe   # must be an even address
 
         self.add_to_queue(
-            [
-                READ_ADDR,
-                (address & 0x000000ff),
-                (address & 0x0000ff00) >> 8,
-                (address & 0x00ff0000) >> 16,
-                (address & 0xff000000) >> 24,
-            ],
-            0.010 * 115200/self._framer._port.baudrate
+            address_command(READ_ADDR, address),
+            self.timing.delay('read', self.baudrate),
+            address=address
         )
 
-        time.sleep(0.05 * 115200.0/self._framer._port.baudrate)
-
     def read_page(self, address):
         address &= 0xfffffffe   # must be an even address
 
-        wait_time = self.max_prog_size/128 * 0.05 * 115200.0 / self._framer._port.baudrate
+        wait_time = self.timing.delay('read_page', self.baudrate, self.max_prog_size / 128)
         logger.debug('wait time: {}'.format(wait_time))
 
         self.add_to_queue(
-            [
-                READ_MAX,
-                (address & 0x000000ff),
-                (address & 0x0000ff00) >> 8,
-                (address & 0x00ff0000) >> 16,
-                (address & 0xff000000) >> 24,
-            ],
-            wait_time
+            address_command(READ_MAX, address),
+            wait_time,
+            address=address
         )
 
     def write_row(self, address, data):
@@ -281,51 +684,34 @@ class BootLoaderThread:
         if len(data) != self.row_length:
             raise ValueError('data width does not match row length')
 
-        to_tx = [
-            WRITE_ROW,
-            (address & 0x000000ff),
-            (address & 0x0000ff00) >> 8,
-            (address & 0x00ff0000) >> 16,
-            (address & 0xff000000) >> 24
-        ]
-
-        for d in data:
-            to_tx.append(d & 0x000000ff)
-            to_tx.append((d & 0x0000ff00) >> 8)
-            to_tx.append((d & 0x00ff0000) >> 16)
-            to_tx.append((d & 0xff000000) >> 24)
+        to_tx = write_row_command(address, data)
 
-        self.add_to_queue(to_tx, 0.05 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(to_tx, self.timing.delay('write_row', self.baudrate), address=address, opcodes=data)
 
-    def write_max(self, address, data):
+    def write_max(self, address, data, callback=None):
         if not self.max_prog_size:
             logger.error('program size has not been set, aborting write')
             return
 
-        prog_map = [0xffffff] * self.max_prog_size
-
-        for i, d in enumerate(data):
-            prog_map[i] = d
-
-        to_tx = [
-            WRITE_MAX,
-            (address & 0x000000ff),
-            (address & 0x0000ff00) >> 8,
-            (address & 0x00ff0000) >> 16,
-            (address & 0xff000000) >> 24
-        ]
-
-        for d in prog_map:
-            to_tx.append(d & 0x000000ff)
-            to_tx.append((d & 0x0000ff00) >> 8)
-            to_tx.append((d & 0x00ff0000) >> 16)
-            to_tx.append((d & 0xff000000) >> 24)
+        to_tx = write_max_command(address, data, self.max_prog_size)
 
         logger.debug('writing maximum length ({}) to program memory'.format(self.max_prog_size))
-        self.add_to_queue(to_tx, len(data) * 0.0005 * 115200/self._framer._port.baudrate)
+        self.add_to_queue(to_tx, self.timing.delay('write_max', self.baudrate, len(data)), callback,
+                          address=address, opcodes=data)
+
+    def clear_memory_map(self):
+        """
+        Forget everything known of the flash of the device, such as when another device has been connected
+        :return: None
+        """
+        self.mirror.clear()
 
     def get_opcode(self, address):
-        return self.local_memory_map[address >> 1]
+        """
+        :param address: the address
+        :return: the opcode read back from the device, or None if it has not been read since it was last changed
+        """
+        return self.mirror.get(address)
 
     def run(self):
         """
@@ -334,13 +720,28 @@ class BootLoaderThread:
         """
         run_once = True
         while (run_once or self._threaded) and self.end is False:
-            self.service_tx_queue()
-            self.parse_messages()
+            start_time = time.perf_counter()
+            try:
+                waited = self.service_tx_queue()
+                self.parse_messages()
+            except Exception as e:
+                logger.error('bootloader thread stopped: {}'.format(e))
+                self.error = e
+                self._in_flight = False
+                self.end = True
+
+                if not self._threaded:
+                    raise
+                return
+
+            self.stats.add_time('work', time.perf_counter() - start_time - waited)
 
             run_once = False
 
             if self._threaded:
+                start_time = time.perf_counter()
                 time.sleep(self._timeout)
+                self.stats.add_time('poll', time.perf_counter() - start_time)
 
         if self._threaded:
             logger.info('bootloader thread complete')
@@ -369,8 +770,8 @@ if __name__ == '__main__':
     #    controller.read(address)
     #    address += 2
 
-    #for i, e in enumerate(controller.local_memory_map[:10]):
-    #    logger.info('{:06X}: {:06X}'.format(i, e))
+    #for i in range(10):
+    #    logger.info('{:06X}: {:06X}'.format(i << 1, controller.get_opcode(i << 1)))
 
     # double-word write
     # controller.write_row(0x2000, [0x00123456, 0x00987654])
@@ -385,8 +786,8 @@ if __name__ == '__main__':
 
     time.sleep(1.0)
 
-    for i, e in enumerate(controller.local_memory_map[:0x300]):
-        print('{:06X} {:06X}'.format(i << 1, e))
+    for i in range(0x300):
+        print('{:06X} {:06X}'.format(i << 1, controller.get_opcode(i << 1)))
 
     controller.end_thread()
     time.sleep(1.0)'''
@@ -2,6 +2,8 @@ import threading
 import time
 import logging
 
+from booty.stats import Stats
+
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.INFO)
 
@@ -15,11 +17,13 @@ class Framer:
     _ESC = 0xf6
     _ESC_XOR = 0x20
 
-    def __init__(self, port, timeout=0.1, threaded=True):
+    def __init__(self, port, timeout=0.1, threaded=True, stats=None):
         self._port = port
         self._timeout = timeout
         self._threaded = threaded
 
+        self.stats = stats if stats is not None else Stats()
+
         self._raw = []
         self._messages = []
 
@@ -27,36 +31,82 @@ class Framer:
             self._runner = threading.Thread(target=self.run, daemon=True)
             self._runner.start()
 
+    def encode(self, message):
+        """
+        Frame a series of bytes so that it is ready to be written to the port
+        :param message: a list of bytes, a bytes-like object or a single byte
+        :return: the encoded frame as bytes
+        """
+        message = bytes(message) if not isinstance(message, int) else bytes([message])
+
+        length = len(message)
+        message_with_length = bytes([length & 0x00ff, (length & 0xff00) >> 8]) + message
+
+        sum1, sum2 = self._fletcher16_checksum(message_with_length)
+        message_with_length += bytes([sum1, sum2])
+
+        # the escape character must be escaped first so that the escapes added
+        # for the start and end of frame characters are not escaped again
+        for b in [self._ESC, self._START_OF_FRAME, self._END_OF_FRAME]:
+            message_with_length = message_with_length.replace(bytes([b]), bytes([self._ESC, b ^ self._ESC_XOR]))
+
+        return bytes([self._START_OF_FRAME]) + message_with_length + bytes([self._END_OF_FRAME])
+
+    def decode(self, frame):
+        """
+        Recover the message from a frame produced by ``encode``
+        :param frame: the encoded frame
+        :return: the message as bytes
+        """
+        if len(frame) < 5 or frame[0] != self._START_OF_FRAME or frame[-1] != self._END_OF_FRAME:
+            raise ValueError('not a complete frame')
+
+        message = self._remove_esc_chars(frame[1:-1])
+
+        sum1, sum2 = self._fletcher16_checksum(message[:-2])
+        if message[-2:] != [sum1, sum2]:
+            raise ValueError('frame checksum does not match')
+
+        return bytes(message[2:-2])
+
     def tx(self, message):
         """
         Transmit a series of bytes
         :param message: a list of bytes to send
         :return: None
         """
-        message = message if isinstance(message, list) else [message]
-
-        length = len(message)
-        length_high_byte = (length & 0xff00) >> 8
-        length_low_byte = length & 0x00ff
-
-        message_with_length = [length_low_byte, length_high_byte] + message
+        self.tx_frame(self.encode(message))
 
-        sum1, sum2 = self._fletcher16_checksum(message_with_length)
-        message_with_length.append(sum1)
-        message_with_length.append(sum2)
+    def tx_frame(self, frame):
+        """
+        Transmit a frame which has already been encoded using ``encode``
+        :param frame: the encoded frame
+        :return: None
+        """
+        self._port.write(frame)
 
-        message = [self._START_OF_FRAME]
+        self.stats.increment('frames_tx')
+        self.stats.increment('bytes_tx', len(frame))
 
-        for b in message_with_length:
-            if b in [self._START_OF_FRAME, self._END_OF_FRAME, self._ESC]:
-                message.append(self._ESC)
-                message.append(b ^ self._ESC_XOR)
-            else:
-                message.append(b)
+    def tx_many(self, messages):
+        """
+        Transmit a batch of messages as one contiguous buffer using a single write
+        :param messages: a sequence of messages, each as accepted by ``tx``
+        :return: None
+        """
+        self.tx_frames([self.encode(message) for message in messages])
 
-        message.append(self._END_OF_FRAME)
+    def tx_frames(self, frames):
+        """
+        Transmit a batch of frames which have already been encoded using a single write
+        :param frames: a sequence of encoded frames
+        :return: None
+        """
+        data = b''.join(frames)
+        self._port.write(data)
 
-        self._port.write(message)
+        self.stats.increment('frames_tx', len(frames))
+        self.stats.increment('bytes_tx', len(data))
 
     def rx(self):
         """
@@ -86,17 +136,19 @@ class Framer:
         data gets placed into self._messages
         :return: None
         """
+        discarded = 0
         if self._START_OF_FRAME in self._raw and self._END_OF_FRAME in self._raw:
 
             while self._raw[0] != self._START_OF_FRAME and len(self._raw) > 0:
                 self._raw.pop(0)
+                discarded += 1
 
             if self._raw[0] == self._START_OF_FRAME:
                 self._raw.pop(0)
 
             eof_index = self._raw.index(self._END_OF_FRAME)
             raw_message = self._raw[:eof_index]
-            self._raw = self._raw[eof_index:]
+            self._raw = self._raw[eof_index + 1:]
 
             logger.debug('raw message: {}'.format(raw_message))
 
@@ -116,17 +168,23 @@ class Framer:
                 message = message[2:]  # remove length
                 logger.debug('valid message received: {}'.format(message))
                 self._messages.append(message)
+                self.stats.increment('frames_rx')
             else:
                 logger.warning('invalid message received: {}, discarding'.format(message))
+                self.stats.increment('checksum_failures')
                 logger.debug('expected checksum: {}, calculated checksum: {}'.format(expected_checksum, calculated_checksum))
 
         # remove any extra bytes at the beginning
         try:
             while self._raw[0] != self._START_OF_FRAME and len(self._raw) > 0:
                 self._raw.pop(0)
+                discarded += 1
         except IndexError:
             pass
 
+        if discarded > 0:
+            self.stats.increment('resyncs')
+
     def _fletcher16_checksum(self, data):
         """
         Calculates a fletcher16 checksum for the list of bytes
@@ -177,6 +235,7 @@ class Framer:
             if waiting > 0:
                 temp = [int(c) for c in self._port.read(waiting)]
                 self._raw += temp
+                self.stats.increment('bytes_rx', len(temp))
 
             self._parse_raw_data()
             run_once = False
@@ -1,3 +1,5 @@
+import struct
+
 import intelhex
 
 
@@ -33,6 +35,57 @@ class HexParser:
 
         return value
 
+    def get_opcodes(self, address, count):
+        """
+        Retrieves a run of consecutive opcodes
+        :param address: the even address of the first opcode
+        :param count: the number of opcodes to retrieve
+        :return: a list of opcodes; unprogrammed locations are 0xffffffff
+        """
+        if address % 2 != 0:
+            raise ValueError('address must be even')
+
+        data = self.memory_map.tobinstr(start=address << 1, size=count * 4)
+        return list(struct.unpack('<{}I'.format(count), data))
+
+
+class HexWriter:
+    """
+    Writes opcodes to an Intel HEX file as they become available, so that
+    nothing but the current record is held in memory.  Rows may be written
+    in any order.
+    """
+    def __init__(self, filename):
+        self._file = open(filename, 'w')
+        self._upper_address = None
+
+    def _write_record(self, record_type, address, data):
+        record = bytes([len(data), (address >> 8) & 0xff, address & 0xff, record_type]) + data
+        checksum = -sum(record) & 0xff
+        self._file.write(':{}{:02X}\n'.format(record.hex().upper(), checksum))
+
+    def write_opcodes(self, address, opcodes):
+        """
+        Writes a run of consecutive opcodes
+        :param address: the even address of the first opcode
+        :param opcodes: the opcodes
+        :return: None
+        """
+        data = struct.pack('<{}I'.format(len(opcodes)), *opcodes)
+        byte_address = address << 1
+
+        for offset in range(0, len(data), 16):
+            record_address = byte_address + offset
+            if record_address >> 16 != self._upper_address:
+                self._upper_address = record_address >> 16
+                self._write_record(0x04, 0, struct.pack('>H', self._upper_address))
+
+            self._write_record(0x00, record_address & 0xffff, data[offset:offset + 16])
+
+    def close(self):
+        self._write_record(0x01, 0, b'')
+        self._file.close()
+
 
 if __name__ == '__main__':
     hp = HexParser('C:/_code/libs/blink.X/dist/default/production/blink.X.production.hex')
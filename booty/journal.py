@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from booty.hex import HexParser
+from booty.util import erase_addresses, write_addresses, bitwise_not
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Journal:
+    """
+    On-disk record of the erase and write operations which have completed
+    for a particular device and image.  The journal is a file of JSON lines;
+    the first line identifies the device and image and each following line
+    records one completed operation.  A journal which belongs to a different
+    device or image is discarded.
+    """
+    def __init__(self, path, device_key, image_hash):
+        self.path = path
+        self._lock = threading.Lock()
+        self._completed = set()
+
+        header = {'device': device_key, 'image': image_hash}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = f.read().splitlines()
+
+            try:
+                if json.loads(lines[0]) == header:
+                    for line in lines[1:]:
+                        record = json.loads(line)
+                        self._completed.add((record['op'], record['address']))
+                else:
+                    logger.info('journal "{}" belongs to another device or image, starting over'.format(path))
+            except (IndexError, ValueError, KeyError):
+                # the last line may be incomplete if the station went down while writing it
+                logger.warning('journal "{}" is truncated, resuming from the last complete record'.format(path))
+
+        self._file = open(path, 'w')
+        self._write_line(header)
+        for op, address in sorted(self._completed):
+            self._write_line({'op': op, 'address': address})
+
+    @property
+    def resuming(self):
+        return len(self._completed) > 0
+
+    def _write_line(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def is_complete(self, op, address):
+        with self._lock:
+            return (op, address) in self._completed
+
+    def record(self, op, address):
+        """
+        Record that an operation has completed
+        :param op: the operation, ``erase`` or ``write``
+        :param address: the address of the operation
+        :return: None
+        """
+        with self._lock:
+            self._completed.add((op, address))
+            self._write_line({'op': op, 'address': address})
+
+    def discard(self, op, address):
+        with self._lock:
+            self._completed.discard((op, address))
+
+    def finish(self):
+        """
+        Close and remove the journal once all operations have completed
+        :return: None
+        """
+        self._file.close()
+        os.remove(self.path)
+
+
+def device_key(boot_loader_app):
+    """
+    Creates a key which identifies the device by its port and identification values
+    :param boot_loader_app: the identified boot loader
+    :return: the key as a string
+    """
+    port = getattr(boot_loader_app.port, 'port', None)
+
+    return '{}:{}:{}:{}:{}:{}:{}'.format(
+        port, boot_loader_app.platform, boot_loader_app.version, boot_loader_app.row_length,
+        boot_loader_app.page_length, boot_loader_app.prog_length, boot_loader_app.max_prog_size
+    )
+
+
+def _image_hash(hex_file_path):
+    with open(hex_file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _read_rows(boot_loader_app, addresses, retries=3):
+    """
+    Reads rows of ``max_prog_size`` opcodes back from the device
+    :return: a dict of address to list of opcodes, or None if the device did not respond
+    """
+    for address in addresses:
+        boot_loader_app.read_page(address)
+
+    rows = {}
+    for address in addresses:
+        row = None
+        for retry in range(retries + 1):
+            row = [boot_loader_app.get_opcode(address + 2 * i) for i in range(boot_loader_app.max_prog_size)]
+            if None not in row:
+                break
+            time.sleep(0.2)
+
+        if None in row:
+            return None
+
+        rows[address] = [opcode & 0xffffff for opcode in row]
+
+    return rows
+
+
+def _check_uncommitted_page(boot_loader_app, hp, journal, writes):
+    """
+    Checks the page containing the first write which was not committed before the
+    interruption.  Rows which already contain the image are committed, rows which
+    are blank are left to be written and, if any row contains anything else, the
+    page is erased and all of its rows are written again.
+    """
+    pending = [a for a in writes if not journal.is_complete('write', a)]
+    if not pending:
+        return
+
+    page_size = boot_loader_app.page_length << 1
+    page_start = pending[0] & bitwise_not(page_size - 1)
+    page_writes = [a for a in writes if page_start <= a < page_start + page_size]
+
+    logger.info('checking uncommitted page {:06X}...'.format(page_start))
+    rows = _read_rows(boot_loader_app, page_writes)
+    if rows is None:
+        raise IOError('could not read page {:06X} from the device'.format(page_start))
+
+    blank = [0xffffff] * boot_loader_app.max_prog_size
+    corrupt = False
+    for address in page_writes:
+        if journal.is_complete('write', address):
+            continue
+
+        expected = [opcode & 0xffffff for opcode in hp.get_opcodes(address, boot_loader_app.max_prog_size)]
+        if rows[address] == expected:
+            journal.record('write', address)
+        elif rows[address] != blank:
+            corrupt = True
+
+    if corrupt:
+        logger.info('page {:06X} was partially written, erasing it again'.format(page_start))
+        for address in page_writes:
+            journal.discard('write', address)
+        boot_loader_app.erase_page(page_start)
+
+
+def journaled_load(boot_loader_app, hex_file_path, journal_directory, buffer_size=8, ranges=None):
+    """
+    Erases and loads the device while recording each completed operation in a
+    journal.  When a previous attempt was interrupted, completed operations are
+    skipped, only the page which was in progress is checked, and loading continues
+    from there.  The journal is removed once the device has been loaded.
+    :param boot_loader_app: the identified boot loader
+    :param hex_file_path: the path to the hex file
+    :param journal_directory: the directory in which journals are kept
+    :param buffer_size: the maximum number of frames waiting to be transmitted
+    :param ranges: when given, only erase and write the pages covering these (start, end) address ranges
+    :return: True if the device was loaded, else False
+    """
+    key = device_key(boot_loader_app)
+    file_name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.journal'
+
+    if not os.path.exists(journal_directory):
+        os.makedirs(journal_directory)
+
+    image = _image_hash(hex_file_path)
+    if ranges:
+        image += ':' + ','.join('{:X}-{:X}'.format(start, end) for start, end in ranges)
+
+    journal = Journal(os.path.join(journal_directory, file_name), key, image)
+    resuming = journal.resuming
+    if resuming:
+        logger.info('resuming interrupted load of {}'.format(key))
+
+    hp = HexParser(hex_file_path)
+
+    logger.info('erasing device...')
+    for address in erase_addresses(boot_loader_app, ranges):
+        if journal.is_complete('erase', address):
+            continue
+
+        boot_loader_app.wait_for_queue_space(buffer_size)
+        boot_loader_app.erase_page(address, callback=lambda a=address: journal.record('erase', a))
+
+    while boot_loader_app.busy and boot_loader_app.alive:
+        time.sleep(0.2)
+
+    if not boot_loader_app.alive:
+        logger.error('boot loader thread ended before erasing completed, journal kept for resuming')
+        return False
+
+    writes = list(write_addresses(boot_loader_app, ranges))
+    if resuming:
+        _check_uncommitted_page(boot_loader_app, hp, journal, writes)
+
+    logger.info('loading device...')
+    for address in writes:
+        if journal.is_complete('write', address):
+            continue
+
+        boot_loader_app.wait_for_queue_space(buffer_size)
+        row_data = hp.get_opcodes(address, boot_loader_app.max_prog_size)
+        boot_loader_app.write_max(address, row_data, callback=lambda a=address: journal.record('write', a))
+
+    while boot_loader_app.busy and boot_loader_app.alive:
+        time.sleep(0.2)
+        logger.info('write operations remaining: {}'.format(boot_loader_app.transactions_remaining))
+
+    if not boot_loader_app.alive:
+        logger.error('boot loader thread ended before loading completed, journal kept for resuming')
+        return False
+
+    journal.finish()
+    logger.info('loading complete!')
+
+    return True
@@ -0,0 +1,106 @@
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class FlashMirror:
+    """
+    What is known of the flash of the device, keyed by address.  Contents
+    which were read back from the device are confirmed.  Contents which
+    follow from the erases and writes sent to it are expected, as the device
+    does not acknowledge them.  Erasing or writing an address replaces any
+    confirmed value, so it must be read again to be confirmed.
+    """
+    def __init__(self):
+        self._confirmed = {}
+        self._expected = {}
+
+    def __len__(self):
+        return len(self._confirmed)
+
+    def clear(self):
+        """
+        Forget everything known of the device
+        :return: None
+        """
+        self._confirmed = {}
+        self._expected = {}
+
+    def erased(self, address, count):
+        """
+        Records an erase
+        :param address: the address of the first opcode erased
+        :param count: the number of opcodes erased
+        :return: None
+        """
+        for i in range(count):
+            self._confirmed.pop(address + 2 * i, None)
+            self._expected[address + 2 * i] = 0xffffff
+
+    def written(self, address, opcodes):
+        """
+        Records a write.  Programming only clears bits, so the result is only
+        known where the previous contents were known.
+        :param address: the address of the first opcode
+        :param opcodes: the opcodes written
+        :return: None
+        """
+        for i, opcode in enumerate(opcodes):
+            a = address + 2 * i
+            previous = self._confirmed.pop(a, self._expected.get(a))
+            if previous is None:
+                self._expected.pop(a, None)
+            else:
+                self._expected[a] = previous & opcode & 0xffffff
+
+    def forget(self, address, count):
+        """
+        Records a change of unknown contents, such as a write of which only the address is known
+        :param address: the address of the first opcode
+        :param count: the number of opcodes
+        :return: None
+        """
+        for i in range(count):
+            self._confirmed.pop(address + 2 * i, None)
+            self._expected.pop(address + 2 * i, None)
+
+    def filled(self, address, opcodes):
+        """
+        Records opcodes read back from the device
+        :param address: the address of the first opcode
+        :param opcodes: the opcodes read
+        :return: None
+        """
+        for i, opcode in enumerate(opcodes):
+            self._confirmed[address + 2 * i] = opcode
+            self._expected.pop(address + 2 * i, None)
+
+    def get(self, address, expected=False):
+        """
+        :param address: the address
+        :param expected: when True, expected contents are returned where nothing was read back
+        :return: the opcode, or None if it is not known
+        """
+        opcode = self._confirmed.get(address)
+        if opcode is None and expected:
+            opcode = self._expected.get(address)
+
+        return opcode
+
+    def confirmed(self, address, count):
+        """
+        :return: True if every opcode of the run has been read back since it was last erased or written
+        """
+        return all(address + 2 * i in self._confirmed for i in range(count))
+
+    def blank(self, address, count):
+        """
+        :return: True if every opcode of the run is known to be 0xffffff, whether confirmed or expected
+        """
+        for i in range(count):
+            opcode = self.get(address + 2 * i, expected=True)
+            if opcode is None or opcode & 0xffffff != 0xffffff:
+                return False
+
+        return True
@@ -0,0 +1,365 @@
+import logging
+import mmap
+import struct
+import time
+
+from booty.comm_thread import ERASE_PAGE, WRITE_ROW, WRITE_MAX, address_command, write_row_command, \
+    write_max_command
+from booty.framer import Framer
+from booty.processors import processors
+from booty.timing import TimingProfile
+from booty.util import erase_addresses, write_addresses, parse_hex
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_MAGIC = b'BOOTYPKG'
+_FORMAT_VERSION = 1
+
+# magic, format version, number of entries, platform, row length, page length,
+# program length, max programming size, application start address
+_HEADER = struct.Struct('<8sBI32sHHIHI')
+
+# command, address, offset of the frame within the file, length of the frame,
+# fixed wait time and wait time at 115200 bits/s, in seconds
+_ENTRY = struct.Struct('<BIIIff')
+
+
+class DeviceProfile:
+    """
+    The identification values of a device, with the same attribute names as
+    the ``BootLoaderThread`` so that either may be used to plan operations
+    """
+    def __init__(self, platform, row_length, page_length, prog_length, max_prog_size, app_start_addr):
+        self.platform = platform
+        self.row_length = row_length
+        self.page_length = page_length
+        self.prog_length = prog_length
+        self.max_prog_size = max_prog_size
+        self.app_start_addr = app_start_addr
+
+    def __str__(self):
+        return '{} (row: {}, page: {}, program length: {}, max program size: {}, app start: {:06X})'.format(
+            self.platform, self.row_length, self.page_length, self.prog_length,
+            self.max_prog_size, self.app_start_addr
+        )
+
+    def matches(self, other):
+        return all(getattr(self, a) == getattr(other, a) for a in
+                   ('platform', 'row_length', 'page_length', 'prog_length', 'max_prog_size', 'app_start_addr'))
+
+
+def profile_from_processor(name):
+    """
+    Creates a device profile from an entry in ``booty.processors``
+    :param name: the processor name, as reported by ``READ_PLATFORM``
+    :return: a ``DeviceProfile``
+    """
+    try:
+        processor = processors[name]
+    except KeyError:
+        raise ValueError('processor "{}" not found, known processors: {}'.format(name, ', '.join(processors)))
+
+    return DeviceProfile(
+        platform=name,
+        row_length=processor['row instructions'],
+        page_length=processor['erase page instructions'],
+        prog_length=processor['program length'],
+        max_prog_size=processor['max program instructions'],
+        app_start_addr=processor['application start address']
+    )
+
+
+def profile_from_boot_loader(boot_loader_app):
+    """
+    Creates a device profile from an identified device
+    :param boot_loader_app: the identified boot loader
+    :return: a ``DeviceProfile``
+    """
+    return DeviceProfile(
+        platform=boot_loader_app.platform,
+        row_length=boot_loader_app.row_length,
+        page_length=boot_loader_app.page_length,
+        prog_length=boot_loader_app.prog_length,
+        max_prog_size=boot_loader_app.max_prog_size,
+        app_start_addr=boot_loader_app.app_start_addr
+    )
+
+
+class PreparedImage:
+    """
+    The framed erase and write commands of an image for a device profile,
+    prepared once so that they may be loaded onto many units.  Per-unit words,
+    such as serial numbers, are applied using ``patched``, which re-encodes only
+    the affected rows and shares every other frame with the base image.
+    """
+    def __init__(self, profile, entries, timing=None):
+        """
+        :param profile: the ``DeviceProfile`` of the target device
+        :param entries: a list of (command, address, frame, fixed wait, scaled wait) tuples
+        :param timing: the ``TimingProfile`` used for the waits of any rows added by patches
+        """
+        self.profile = profile
+        self.entries = entries
+        self.timing = timing if timing is not None else TimingProfile()
+
+        self._write_index = {address: i for i, (command, address, _, _, _) in enumerate(entries)
+                             if command == WRITE_MAX}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def patched(self, patches):
+        """
+        Creates a copy of the image with individual words replaced.  Words within
+        a row written by the image are placed in that row.  Words elsewhere, such
+        as in the user ID area, are written using ``WRITE_ROW`` after the image,
+        padded with 0xffffff, so those locations must already be blank.  Words
+        of the boot loader, between the first page and the application space,
+        are refused.
+        :param patches: a dict of address to opcode
+        :return: a ``PreparedImage``
+        """
+        framer = Framer(port=None, threaded=False)
+        max_prog_size = self.profile.max_prog_size
+        row_length = self.profile.row_length
+        page_size = self.profile.page_length << 1
+
+        rows = {}
+        for address, opcode in patches.items():
+            if address % 2 != 0:
+                raise ValueError('address {:06X} must be even'.format(address))
+            row = address - address % (max_prog_size << 1)
+            rows.setdefault(row, {})[(address - row) >> 1] = opcode
+
+        entries = list(self.entries)
+        added = {}
+        for row, words in sorted(rows.items()):
+            if row in self._write_index:
+                i = self._write_index[row]
+                command, address, frame, fixed_wait, scaled_wait = entries[i]
+
+                payload = framer.decode(frame)
+                opcodes = list(struct.unpack_from('<{}I'.format(max_prog_size), payload, 5))
+                for index, opcode in words.items():
+                    opcodes[index] = opcode
+
+                entries[i] = (command, address, framer.encode(write_max_command(address, opcodes, max_prog_size)),
+                              fixed_wait, scaled_wait)
+                continue
+
+            if page_size <= row < self.profile.app_start_addr:
+                raise ValueError('address {:06X} is within the boot loader, below the application start '
+                                 'address {:06X}'.format(row, self.profile.app_start_addr))
+
+            for index, opcode in words.items():
+                address = row + (index - index % row_length) * 2
+                added.setdefault(address, [0xffffff] * row_length)[index % row_length] = opcode
+
+        for address, opcodes in sorted(added.items()):
+            entries.append((WRITE_ROW, address, framer.encode(write_row_command(address, opcodes)))
+                           + self.timing.parts('write_row'))
+
+        return PreparedImage(self.profile, entries, self.timing)
+
+
+def prepare_image(hex_file_path, profile, timing=None):
+    """
+    Prepares the framed erase and write commands of a hex file
+    :param hex_file_path: the path to the hex file or a ``HexParser``
+    :param profile: the ``DeviceProfile`` of the target device
+    :param timing: the ``TimingProfile`` used for the waits, defaults to the default timing
+    :return: a ``PreparedImage``
+    """
+    timing = timing if timing is not None else TimingProfile()
+
+    hp = parse_hex(hex_file_path)
+    framer = Framer(port=None, threaded=False)
+
+    entries = []
+    for address in erase_addresses(profile):
+        entries.append((ERASE_PAGE, address, framer.encode(address_command(ERASE_PAGE, address)))
+                       + timing.parts('erase_page'))
+
+    for address in write_addresses(profile):
+        row_data = hp.get_opcodes(address, profile.max_prog_size)
+        entries.append((WRITE_MAX, address, framer.encode(write_max_command(address, row_data, profile.max_prog_size)))
+                       + timing.parts('write_max', len(row_data)))
+
+    return PreparedImage(profile, entries, timing)
+
+
+def write_package(image, package_path):
+    """
+    Writes a prepared image to a package
+    :param image: the ``PreparedImage``
+    :param package_path: the path of the package to create
+    :return: None
+    """
+    profile = image.profile
+
+    with open(package_path, 'wb') as f:
+        f.write(_HEADER.pack(
+            _MAGIC, _FORMAT_VERSION, len(image.entries), profile.platform.encode('ascii'),
+            profile.row_length, profile.page_length, profile.prog_length,
+            profile.max_prog_size, profile.app_start_addr
+        ))
+
+        offset = _HEADER.size + _ENTRY.size * len(image.entries)
+        for command, address, frame, fixed_wait, scaled_wait in image.entries:
+            f.write(_ENTRY.pack(command, address, offset, len(frame), fixed_wait, scaled_wait))
+            offset += len(frame)
+
+        for _, _, frame, _, _ in image.entries:
+            f.write(frame)
+
+
+def compile_package(hex_file_path, profile, package_path, timing=None):
+    """
+    Compiles a hex file into a package of framed erase and write commands
+    which are ready to be written to the port
+    :param hex_file_path: the path to the hex file
+    :param profile: the ``DeviceProfile`` of the target device
+    :param package_path: the path of the package to create
+    :param timing: the ``TimingProfile`` used for the waits, defaults to the default timing
+    :return: the number of commands in the package
+    """
+    image = prepare_image(hex_file_path, profile, timing)
+    write_package(image, package_path)
+
+    logger.info('compiled {} commands for {} into "{}"'.format(len(image), profile, package_path))
+
+    return len(image)
+
+
+def read_package(package_path):
+    """
+    Reads a package into a prepared image
+    :param package_path: the path to the package
+    :return: a ``PreparedImage``
+    """
+    with open(package_path, 'rb') as f:
+        contents = f.read()
+
+    profile, count = read_package_header(contents)
+    entries = [(command, address, contents[offset:offset + length], fixed_wait, scaled_wait)
+               for command, address, offset, length, fixed_wait, scaled_wait in iter_package_entries(contents, count)]
+
+    return PreparedImage(profile, entries)
+
+
+def read_package_header(contents):
+    """
+    Reads the header of a package
+    :param contents: the contents of the package as a bytes-like object
+    :return: a tuple containing the ``DeviceProfile`` and the number of entries
+    """
+    magic, version, count, platform, row_length, page_length, prog_length, max_prog_size, app_start_addr = \
+        _HEADER.unpack_from(contents)
+
+    if magic != _MAGIC or version != _FORMAT_VERSION:
+        raise ValueError('not a supported booty package')
+
+    profile = DeviceProfile(
+        platform=platform.rstrip(b'\0').decode('ascii'),
+        row_length=row_length,
+        page_length=page_length,
+        prog_length=prog_length,
+        max_prog_size=max_prog_size,
+        app_start_addr=app_start_addr
+    )
+
+    return profile, count
+
+
+def iter_package_entries(contents, count):
+    """
+    Generates the index entries of a package
+    :param contents: the contents of the package as a bytes-like object
+    :param count: the number of entries
+    :return: a generator of (command, address, offset, length, fixed wait, scaled wait) tuples
+    """
+    for i in range(count):
+        yield _ENTRY.unpack_from(contents, _HEADER.size + i * _ENTRY.size)
+
+
+def load_package(boot_loader_app, package_path, buffer_size=8):
+    """
+    Erases and loads the device by streaming the frames of a compiled package
+    from a memory map straight into the transmit queue
+    :param boot_loader_app: the identified boot loader
+    :param package_path: the path to the package
+    :param buffer_size: the maximum number of frames waiting to be transmitted
+    :return: True if the package was loaded, else False
+    """
+    logger.info('loading device from package...')
+    start_time = time.perf_counter()
+
+    with open(package_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            profile, count = read_package_header(mm)
+
+            device_profile = profile_from_boot_loader(boot_loader_app)
+            if not profile.matches(device_profile):
+                logger.error('package was compiled for {}, but the device is {}'.format(profile, device_profile))
+                return False
+
+            scale = 115200 / boot_loader_app.baudrate
+            for command, address, offset, length, fixed_wait, scaled_wait in iter_package_entries(mm, count):
+                boot_loader_app.wait_for_queue_space(buffer_size)
+                boot_loader_app.add_frame_to_queue(command, mm[offset:offset + length],
+                                                   fixed_wait + scaled_wait * scale, address=address)
+
+    # wait for all transmissions are complete
+    while boot_loader_app.busy:
+        time.sleep(0.2)
+        logger.info('package operations remaining: {}'.format(boot_loader_app.transactions_remaining))
+
+    boot_loader_app.tracer.complete('load_package', start_time)
+    if boot_loader_app.error is not None:
+        logger.error('loading failed: {}'.format(boot_loader_app.error))
+        return False
+
+    logger.info('loading complete!')
+
+    return True
+
+
+def load_prepared(boot_loader_app, image, buffer_size=8, erase=True):
+    """
+    Erases and loads the device from a prepared image
+    :param boot_loader_app: the identified boot loader
+    :param image: the ``PreparedImage``
+    :param buffer_size: the maximum number of frames waiting to be transmitted
+    :param erase: when False, the erase commands of the image are skipped
+    :return: True if the image was loaded, else False
+    """
+    logger.info('loading device from prepared image...')
+    start_time = time.perf_counter()
+
+    device_profile = profile_from_boot_loader(boot_loader_app)
+    if not image.profile.matches(device_profile):
+        logger.error('image was prepared for {}, but the device is {}'.format(image.profile, device_profile))
+        return False
+
+    scale = 115200 / boot_loader_app.baudrate
+    for command, address, frame, fixed_wait, scaled_wait in image.entries:
+        if command == ERASE_PAGE and not erase:
+            continue
+
+        boot_loader_app.wait_for_queue_space(buffer_size)
+        boot_loader_app.add_frame_to_queue(command, frame, fixed_wait + scaled_wait * scale, address=address)
+
+    # wait for all transmissions are complete
+    while boot_loader_app.busy:
+        time.sleep(0.2)
+        logger.info('operations remaining: {}'.format(boot_loader_app.transactions_remaining))
+
+    boot_loader_app.tracer.complete('load_prepared', start_time)
+    if boot_loader_app.error is not None:
+        logger.error('loading failed: {}'.format(boot_loader_app.error))
+        return False
+
+    logger.info('loading complete!')
+
+    return True
@@ -1,6 +1,10 @@
 processors = {
     'dspic33ep32mc204': {
         'erase page instructions': 512,
+        'row instructions': 2,
+        'max program instructions': 128,
+        'program length': 0x55ec,
+        'application start address': 0x1000,
         'config address': 0x57ec,
         'user id': 0x800ff8,
         'device id': 0xff0000
@@ -0,0 +1,336 @@
+import collections
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from booty.package import prepare_image, profile_from_boot_loader, load_prepared
+from booty.util import create_serial_port, create_blt, identify_device, parse_hex, \
+    erase_device, load_hex, verify_hex
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+OPERATIONS = ('erase', 'load', 'verify')
+
+
+class Job:
+    """
+    A queued erase/load/verify request against a single port
+    """
+    def __init__(self, job_id, port, operations, hexfile=None, baudrate=115200, identify=False, patches=None):
+        self.id = job_id
+        self.port = port
+        self.operations = operations
+        self.hexfile = hexfile
+        self.baudrate = baudrate
+        self.identify = identify
+        self.patches = patches or {}
+
+        self.status = 'queued'
+        self.results = {}
+        self.error = None
+
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'port': self.port,
+            'operations': list(self.operations),
+            'hexfile': self.hexfile,
+            'baudrate': self.baudrate,
+            'patches': {'0x{:06X}'.format(a): v for a, v in self.patches.items()},
+            'status': self.status,
+            'results': self.results,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+
+class FlashServer:
+    """
+    Runs queued jobs while keeping serial ports open, devices identified and
+    parsed hex files in memory between jobs.  Jobs for the same port run in
+    order on a worker thread dedicated to that port.
+    """
+    def __init__(self, history=1000, port_factory=create_serial_port):
+        self._history = history
+        self._port_factory = port_factory
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = collections.OrderedDict()
+        self._queues = {}
+        self._devices = {}
+        self._images = {}
+        self._prepared = {}
+
+    def submit(self, port, operations, hexfile=None, baudrate=115200, identify=False, patches=None):
+        """
+        Queue a job
+        :param port: the serial port of the device
+        :param operations: a sequence of operations from ``OPERATIONS``, executed in that order
+        :param hexfile: the path to the hex file, required to load or verify
+        :param baudrate: the baud rate of the port
+        :param identify: identify the device again, such as when a new board has been connected
+        :param patches: a dict of address to opcode loaded in place of the image contents, such as a serial number
+        :return: the ``Job``
+        """
+        if isinstance(operations, str):
+            raise TypeError('operations must be a sequence of operations, not a string')
+
+        operations = [op for op in OPERATIONS if op in operations]
+        if not operations:
+            raise ValueError('no operations specified, expected any of {}'.format(', '.join(OPERATIONS)))
+        if ('load' in operations or 'verify' in operations) and not hexfile:
+            raise ValueError('a hex file is required to load or verify')
+
+        with self._lock:
+            job = Job(next(self._ids), port, operations, hexfile, baudrate, identify, patches)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._history:
+                self._jobs.popitem(last=False)
+
+            if port not in self._queues:
+                self._queues[port] = queue.Queue()
+                threading.Thread(target=self._work, args=(self._queues[port],), daemon=True).start()
+
+            self._queues[port].put(job)
+
+        return job
+
+    def job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def devices(self):
+        with self._lock:
+            devices = dict(self._devices)
+
+        return {
+            port: {
+                'baudrate': blt.baudrate,
+                'identified': blt.device_identified,
+                'platform': blt.platform,
+                'version': blt.version,
+                'prog_length': blt.prog_length
+            } for port, blt in devices.items()
+        }
+
+    def _image(self, path):
+        stat = os.stat(path)
+        key = (stat.st_mtime, stat.st_size)
+
+        with self._lock:
+            cached = self._images.get(path)
+
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        logger.info('parsing "{}"'.format(path))
+        hp = parse_hex(path)
+        with self._lock:
+            self._images[path] = (key, hp)
+
+        return hp
+
+    def _prepared_image(self, path, blt):
+        """
+        Prepares the frames of an image once for each device profile, so that
+        per-unit patches only re-encode the affected rows
+        """
+        profile = profile_from_boot_loader(blt)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime, stat.st_size, str(profile))
+
+        with self._lock:
+            image = self._prepared.get(key)
+
+        if image is None:
+            image = prepare_image(self._image(path), profile, blt.timing)
+            with self._lock:
+                self._prepared[key] = image
+
+        return image
+
+    def _close_device(self, port):
+        with self._lock:
+            blt = self._devices.pop(port, None)
+
+        if blt is not None:
+            blt.end_thread()
+            blt.port.close()
+
+    def _device(self, port, baudrate, identify):
+        with self._lock:
+            blt = self._devices.get(port)
+
+        # a thread which stopped, such as when the cable was pulled, is replaced along with its port
+        if blt is not None and (blt.baudrate != baudrate or not blt.alive):
+            self._close_device(port)
+            blt = None
+
+        if blt is None:
+            blt = create_blt(self._port_factory(port, baudrate))
+            with self._lock:
+                self._devices[port] = blt
+
+        elif identify or not blt.device_identified:
+            blt.reset_identification()
+
+        if not blt.device_identified and not identify_device(blt):
+            self._close_device(port)
+            raise IOError('device on {} not responding'.format(port))
+
+        return blt
+
+    def _work(self, jobs):
+        while True:
+            job = jobs.get()
+            job.status = 'running'
+            job.started = time.time()
+            logger.info('starting job {}: {} on {}'.format(job.id, ', '.join(job.operations), job.port))
+
+            try:
+                self._run(job)
+                job.status = 'succeeded' if all(job.results.values()) else 'failed'
+            except Exception as e:
+                logger.exception('job {} failed'.format(job.id))
+                job.status = 'failed'
+                job.error = str(e)
+
+            job.finished = time.time()
+            logger.info('job {} {} in {:.2f}s'.format(job.id, job.status, job.finished - job.started))
+
+    def _run(self, job):
+        hp = self._image(job.hexfile) if job.hexfile else None
+        blt = self._device(job.port, job.baudrate, job.identify)
+
+        if 'erase' in job.operations:
+            job.results['erase'] = erase_device(blt)
+
+        if 'load' in job.operations:
+            if job.patches:
+                image = self._prepared_image(job.hexfile, blt).patched(job.patches)
+                job.results['load'] = load_prepared(blt, image, erase=False)
+            else:
+                job.results['load'] = load_hex(blt, hp)
+
+        if 'verify' in job.operations:
+            blt.clear_memory_map()
+            job.results['verify'] = verify_hex(blt, hp, overrides=job.patches)
+
+    def shutdown(self):
+        with self._lock:
+            ports = list(self._devices)
+
+        for port in ports:
+            self._close_device(port)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API::
+
+        POST /jobs          {"port": ..., "operations": [...], "hexfile": ..., "baudrate": ...,
+                             "identify": ..., "patches": {"<address>": <opcode>, ...}}
+        GET  /jobs          all jobs in the history
+        GET  /jobs/<id>     the status of a single job
+        GET  /devices       open ports and their identification
+    """
+    def _respond(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        flash_server = self.server.flash_server
+        parts = [p for p in self.path.split('/') if p]
+
+        if parts == ['jobs']:
+            self._respond(200, [job.as_dict() for job in flash_server.jobs()])
+
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = flash_server.job(int(parts[1])) if parts[1].isdigit() else None
+            if job is None:
+                self._respond(404, {'error': 'job not found'})
+            else:
+                self._respond(200, job.as_dict())
+
+        elif parts == ['devices']:
+            self._respond(200, flash_server.devices())
+
+        else:
+            self._respond(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self._respond(404, {'error': 'not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise TypeError('the request must be an object')
+
+            operations = request.get('operations', [])
+            if not isinstance(operations, list):
+                raise TypeError('operations must be a list')
+
+            patches = request.get('patches', {})
+            if not isinstance(patches, dict):
+                raise TypeError('patches must be an object of address to value')
+
+            job = self.server.flash_server.submit(
+                port=request['port'],
+                operations=operations,
+                hexfile=request.get('hexfile'),
+                baudrate=int(request.get('baudrate', 115200)),
+                identify=bool(request.get('identify', False)),
+                patches={int(a, 0): int(v, 0) if isinstance(v, str) else int(v)
+                         for a, v in patches.items()}
+            )
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            self._respond(400, {'error': str(e)})
+            return
+
+        self._respond(202, job.as_dict())
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def create_server(host='127.0.0.1', port=7878, flash_server=None):
+    """
+    Creates the HTTP server; call ``serve_forever()`` on the result to run it
+    :param host: the address to listen on
+    :param port: the TCP port to listen on
+    :param flash_server: the ``FlashServer`` which runs the jobs
+    :return: the HTTP server
+    """
+    httpd = _HTTPServer((host, port), _RequestHandler)
+    httpd.flash_server = flash_server if flash_server is not None else FlashServer()
+
+    return httpd
@@ -0,0 +1,289 @@
+import logging
+import struct
+import threading
+import time
+
+from booty.comm_thread import READ_PLATFORM, READ_VERSION, READ_ROW_LEN, READ_PAGE_LEN, READ_PROG_LEN, \
+    READ_MAX_PROG_SIZE, READ_APP_START_ADDRESS, READ_BOOT_START_ADDRESS, READ_BAUD_RATES, SET_BAUD_RATE, \
+    ERASE_PAGE, BLANK_CHECK, READ_ADDR, READ_MAX, WRITE_ROW, WRITE_MAX, START_APP, BAUD_RATE_REVERT_TIME
+from booty.framer import Framer
+from booty.processors import processors
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class SimulatedDevice:
+    """
+    A model of the boot loader firmware, which keeps the flash memory in a
+    dictionary of address to opcode and answers each command as the device would
+    """
+    def __init__(self, platform='dspic33ep32mc204', version='0.1', boot_start_addr=0x400,
+                 baud_rates=(115200, 230400, 460800, 921600), blank_check=True):
+        processor = processors[platform]
+
+        self.platform = platform
+        self.version = version
+        self.row_length = processor['row instructions']
+        self.page_length = processor['erase page instructions']
+        self.prog_length = processor['program length']
+        self.max_prog_size = processor['max program instructions']
+        self.app_start_addr = processor['application start address']
+        self.boot_start_addr = boot_start_addr
+        self.baud_rates = baud_rates
+        self.supports_blank_check = blank_check
+
+        self.flash = {}
+        self.running = False
+
+    def read_opcode(self, address):
+        return self.flash.get(address, 0xffffff)
+
+    def handle(self, message):
+        """
+        Executes a command
+        :param message: the command, without framing
+        :return: the response as a list of bytes, or None when the command has no response
+        """
+        command = message[0]
+
+        if self.running:
+            return None
+
+        if command == READ_PLATFORM:
+            return [command] + list(self.platform.encode('ascii'))
+
+        elif command == READ_VERSION:
+            return [command] + list(self.version.encode('ascii'))
+
+        elif command in (READ_ROW_LEN, READ_PAGE_LEN, READ_MAX_PROG_SIZE,
+                         READ_APP_START_ADDRESS, READ_BOOT_START_ADDRESS):
+            value = {
+                READ_ROW_LEN: self.row_length,
+                READ_PAGE_LEN: self.page_length,
+                READ_MAX_PROG_SIZE: self.max_prog_size,
+                READ_APP_START_ADDRESS: self.app_start_addr,
+                READ_BOOT_START_ADDRESS: self.boot_start_addr
+            }[command]
+            return [command] + list(struct.pack('<H', value))
+
+        elif command == READ_PROG_LEN:
+            return [command] + list(struct.pack('<I', self.prog_length))
+
+        elif command == READ_BAUD_RATES:
+            if not self.baud_rates:
+                return None
+            return [command] + list(struct.pack('<{}I'.format(len(self.baud_rates)), *self.baud_rates))
+
+        elif command == SET_BAUD_RATE:
+            baudrate, = struct.unpack_from('<I', bytes(message), 1)
+            if not self.baud_rates or baudrate not in self.baud_rates:
+                return None
+            return [command] + list(struct.pack('<I', baudrate))
+
+        address, = struct.unpack_from('<I', bytes(message), 1)
+
+        if command == ERASE_PAGE:
+            page_start = address & ~((self.page_length << 1) - 1)
+            for i in range(self.page_length):
+                self.flash.pop(page_start + 2 * i, None)
+
+        elif command == BLANK_CHECK:
+            if not self.supports_blank_check:
+                return None
+            pages, = struct.unpack_from('<H', bytes(message), 5)
+            page_size = self.page_length << 1
+            page_start = address & ~(page_size - 1)
+
+            bitmap = [0] * ((pages + 7) // 8)
+            for i in range(pages):
+                start = page_start + i * page_size
+                if not any(start <= a < start + page_size and opcode != 0xffffff for a, opcode in self.flash.items()):
+                    bitmap[i >> 3] |= 1 << (i & 7)
+
+            return [command] + list(struct.pack('<IH', page_start, pages)) + bitmap
+
+        elif command in (READ_ADDR, READ_MAX):
+            count = 1 if command == READ_ADDR else self.max_prog_size
+            opcodes = [self.read_opcode(address + 2 * i) for i in range(count)]
+            return [command] + list(struct.pack('<I{}I'.format(count), address, *opcodes))
+
+        elif command in (WRITE_ROW, WRITE_MAX):
+            data = bytes(message[5:])
+            for i, opcode in enumerate(struct.unpack('<{}I'.format(len(data) // 4), data)):
+                # programming may only clear bits
+                self.flash[address + 2 * i] = self.read_opcode(address + 2 * i) & opcode & 0xffffff
+
+        elif command == START_APP:
+            self.running = True
+
+        return None
+
+
+class _DeviceSide:
+    """
+    The end of the simulated serial line which is attached to the device
+    """
+    def __init__(self):
+        self.received = bytearray()
+        self.transmitted = bytearray()
+
+    @property
+    def in_waiting(self):
+        return len(self.received)
+
+    def read(self, size=1):
+        data = bytes(self.received[:size])
+        del self.received[:size]
+        return data
+
+    def write(self, data):
+        self.transmitted += data
+        return len(data)
+
+
+class SimulatedPort:
+    """
+    A serial port with a ``SimulatedDevice`` at the other end, presenting the
+    subset of the ``serial.Serial`` interface used by the ``Framer``.
+
+    Both ends have a baud rate.  While they differ, the data in both directions
+    is lost, as it would be on a real line.  Rates above ``max_line_rate`` are
+    lost as well, which models a cable or level shifter that cannot keep up.
+    When ``busy`` is set, commands which arrive while the device is still busy
+    with earlier commands are dropped, based upon the time each frame takes to
+    arrive at the current baud rate.
+    """
+    def __init__(self, device=None, baudrate=115200, max_line_rate=None, busy=False, receive_buffer=8):
+        self.port = 'sim://{}'.format(device.platform if device else 'dspic33ep32mc204')
+        self.device = device if device is not None else SimulatedDevice()
+        self.max_line_rate = max_line_rate
+        self.busy = busy
+        self.receive_buffer = receive_buffer
+        self.dropped = 0
+
+        self.baudrate = baudrate
+        self._device_baudrate = baudrate
+        self._previous_baudrate = None
+        self._revert_at = None
+
+        self._side = _DeviceSide()
+        self._framer = Framer(self._side, threaded=False)
+
+        self._lock = threading.Lock()
+        self._to_host = bytearray()
+        self._pending = []
+        self._stalled_until = 0.0
+        self._closed = False
+
+    @property
+    def is_open(self):
+        return not self._closed
+
+    def _line_ok(self):
+        self._check_revert()
+        if self.baudrate != self._device_baudrate:
+            return False
+
+        return self.max_line_rate is None or self.baudrate <= self.max_line_rate
+
+    def _check_revert(self):
+        if self._revert_at is not None and time.perf_counter() > self._revert_at:
+            logger.debug('no frame received at {} bits/s, reverting to {} bits/s'.format(
+                self._device_baudrate, self._previous_baudrate))
+            self._device_baudrate = self._previous_baudrate
+            self._revert_at = None
+
+    def _cost(self, command):
+        """
+        :return: the time the device is busy with a command and whether it stops receiving meanwhile
+        """
+        scale = 115200 / self._device_baudrate
+        if command == ERASE_PAGE:
+            return 0.015, True
+        if command == WRITE_ROW:
+            return 0.004, True
+        if command == WRITE_MAX:
+            return 0.00015 * self.device.max_prog_size, True
+        if command == READ_MAX:
+            return 0.03 * scale * self.device.max_prog_size / 128, False
+        return 0.002 * scale, False
+
+    def _accept(self, command, arrival):
+        if not self.busy:
+            return True
+
+        if arrival < self._stalled_until:
+            return False
+
+        self._pending = [finish for finish in self._pending if finish > arrival]
+        if len(self._pending) >= self.receive_buffer:
+            return False
+
+        cost, stalls = self._cost(command)
+        finish = max([arrival] + self._pending) + cost
+        self._pending.append(finish)
+        if stalls:
+            self._stalled_until = finish
+
+        return True
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            return len(self._to_host)
+
+    def read(self, size=1):
+        with self._lock:
+            data = bytes(self._to_host[:size])
+            del self._to_host[:size]
+            return data
+
+    def write(self, data):
+        data = bytes(data)
+        start_time = time.perf_counter()
+
+        if not self._line_ok():
+            self.dropped += 1
+            return len(data)
+
+        # deliver each frame at the time its last byte arrives
+        start = 0
+        for i, byte in enumerate(data):
+            if byte != Framer._END_OF_FRAME and i != len(data) - 1:
+                continue
+
+            self._side.received += data[start:i + 1]
+            start = i + 1
+            arrival = start_time + start * 10 / self.baudrate
+
+            while not self._framer.is_empty():
+                message = self._framer.rx()
+                if self._accept(message[0], arrival):
+                    self._execute(message)
+                else:
+                    self.dropped += 1
+
+        return len(data)
+
+    def _execute(self, message):
+        # a valid frame at the new rate confirms a baud rate change
+        self._revert_at = None
+
+        response = self.device.handle(message)
+        if response is None:
+            return
+
+        self._side.transmitted.clear()
+        self._framer.tx(response)
+        with self._lock:
+            self._to_host += self._side.transmitted
+
+        if message[0] == SET_BAUD_RATE:
+            baudrate, = struct.unpack_from('<I', bytes(message), 1)
+            self._previous_baudrate = self._device_baudrate
+            self._device_baudrate = baudrate
+            self._revert_at = time.perf_counter() + BAUD_RATE_REVERT_TIME
+
+    def close(self):
+        self._closed = True
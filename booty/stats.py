@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+
+# upper bounds of the round-trip histogram buckets, in seconds
+_HISTOGRAM_BOUNDS = (0.001, 0.002, 0.005, 0.010, 0.020, 0.050, 0.100, 0.200, 0.500, 1.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations
+    """
+    def __init__(self, bounds=_HISTOGRAM_BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        """
+        Add a single sample to the histogram
+        :param value: the duration, in seconds
+        :return: None
+        """
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.buckets[index] += 1
+
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def as_dict(self):
+        labels = ['<={}'.format(b) for b in self.bounds] + ['>{}'.format(self.bounds[-1])]
+
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.minimum,
+            'max': self.maximum,
+            'buckets': dict(zip(labels, self.buckets))
+        }
+
+
+class Stats:
+    """
+    Collects the counters, command round-trip times and time accounting
+    of a bootloader session.  A single instance is shared by the
+    ``Framer`` and the ``BootLoaderThread`` that owns it.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+
+        self.counters = {
+            'frames_tx': 0,
+            'frames_rx': 0,
+            'bytes_tx': 0,
+            'bytes_rx': 0,
+            'checksum_failures': 0,
+            'resyncs': 0,
+            'response_timeouts': 0
+        }
+        self.round_trips = {}
+        self.timeouts = {}
+        self.timers = {
+            'work': 0.0,
+            'tx_wait': 0.0,
+            'poll': 0.0
+        }
+
+    def increment(self, name, value=1):
+        """
+        Increment a counter
+        :param name: the name of the counter
+        :param value: the amount to add to the counter
+        :return: None
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_round_trip(self, command, seconds):
+        """
+        Record the time between transmitting a command and parsing its response
+        :param command: the command code
+        :param seconds: the round trip time
+        :return: None
+        """
+        with self._lock:
+            if command not in self.round_trips:
+                self.round_trips[command] = Histogram()
+            self.round_trips[command].add(seconds)
+
+    def add_timeout(self, command):
+        """
+        Record a command whose response was not received
+        :param command: the command code
+        :return: None
+        """
+        with self._lock:
+            self.counters['response_timeouts'] += 1
+            self.timeouts[command] = self.timeouts.get(command, 0) + 1
+
+    def add_time(self, category, seconds):
+        """
+        Account for time spent; ``work`` is time spent processing, ``tx_wait`` and
+        ``poll`` are time spent sleeping after a transmission and between polls
+        :param category: the timer to add to
+        :param seconds: the time spent
+        :return: None
+        """
+        with self._lock:
+            self.timers[category] = self.timers.get(category, 0.0) + seconds
+
+    def as_dict(self):
+        with self._lock:
+            sleeping = sum(v for k, v in self.timers.items() if k != 'work')
+
+            return {
+                'elapsed': time.perf_counter() - self._start_time,
+                'counters': dict(self.counters),
+                'round_trips': {'0x{:02X}'.format(command): histogram.as_dict()
+                                for command, histogram in sorted(self.round_trips.items())},
+                'timeouts': {'0x{:02X}'.format(command): count for command, count in sorted(self.timeouts.items())},
+                'timers': dict(self.timers),
+                'sleeping': sleeping,
+                'working': self.timers.get('work', 0.0)
+            }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.as_dict(), indent=indent)
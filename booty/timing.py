@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# time to wait after each command, in seconds, made of the time taken to
+# transfer the data at 115200 bits/s, which scales with the baud rate, and the
+# time the device spends executing the command, which does not
+DEFAULT_DELAYS = {
+    'query': 0.01,          # each identification query
+    'erase_page': 0.0,      # a page erase
+    'blank_check': 0.0,     # BLANK_CHECK, per page, in addition to the query delay
+    'read': 0.01,           # READ_ADDR
+    'read_page': 0.05,      # READ_MAX, per 128 opcodes
+    'write_row': 0.05,      # WRITE_ROW
+    'write_max': 0.0004     # WRITE_MAX, per opcode written
+}
+
+DEFAULT_FIXED_DELAYS = {
+    'erase_page': 0.025,
+    'blank_check': 0.001,
+    'write_max': 0.0001
+}
+
+DEFAULT_TIMING_DIRECTORY = os.path.join(os.path.expanduser('~'), '.booty', 'timing')
+
+
+class TimingProfile:
+    """
+    The per-command delays used by the ``BootLoaderThread``, either the
+    defaults or the result of a calibration against a platform
+    """
+    def __init__(self, platform=None, delays=None, fixed=None):
+        self.platform = platform
+
+        self.delays = dict(DEFAULT_DELAYS)
+        if delays:
+            self.delays.update(delays)
+
+        self.fixed = dict(DEFAULT_FIXED_DELAYS)
+        if fixed:
+            self.fixed.update(fixed)
+
+    def __str__(self):
+        return '{}: {}'.format(self.platform, ', '.join(
+            '{}={:.4f}'.format(k, self.delay(k, 115200)) for k in sorted(self.delays)))
+
+    def parts(self, command, count=1):
+        """
+        Splits the delay of a command into the part which does not depend upon
+        the baud rate and the part which does
+        :param command: the name of the command, as in ``DEFAULT_DELAYS``
+        :param count: the number of units, such as opcodes, that the delay is specified for
+        :return: a tuple containing the fixed delay and the delay at 115200 bits/s
+        """
+        return self.fixed.get(command, 0.0) * count, self.delays[command] * count
+
+    def delay(self, command, baudrate, count=1):
+        """
+        Calculates the time to wait after a command
+        :param command: the name of the command, as in ``DEFAULT_DELAYS``
+        :param baudrate: the baud rate of the port
+        :param count: the number of units, such as opcodes, that the delay is specified for
+        :return: the delay in seconds
+        """
+        fixed, scaled = self.parts(command, count)
+        return fixed + scaled * 115200 / baudrate
+
+    def scaled(self, command, factor):
+        """
+        Creates a copy of the profile with both parts of the delay of one command multiplied by a factor
+        :return: a ``TimingProfile``
+        """
+        fixed, scaled = self.parts(command)
+        return TimingProfile(self.platform, dict(self.delays, **{command: scaled * factor}),
+                             dict(self.fixed, **{command: fixed * factor}))
+
+    def as_dict(self):
+        return {'platform': self.platform, 'delays': dict(self.delays), 'fixed': dict(self.fixed)}
+
+
+def _timing_path(platform, directory):
+    return os.path.join(directory, '{}.json'.format(platform))
+
+
+def load_timing(platform, directory=DEFAULT_TIMING_DIRECTORY):
+    """
+    Loads the timing profile of a platform
+    :param platform: the platform, as reported by the device
+    :param directory: the directory in which timing profiles are kept
+    :return: a ``TimingProfile``, or None if the platform has not been calibrated
+    """
+    path = _timing_path(platform, directory)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        profile = json.load(f)
+
+    return TimingProfile(platform, profile['delays'], profile.get('fixed'))
+
+
+def save_timing(profile, directory=DEFAULT_TIMING_DIRECTORY):
+    """
+    Saves the timing profile of a platform
+    :param profile: the ``TimingProfile``
+    :param directory: the directory in which timing profiles are kept
+    :return: the path of the saved profile
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    path = _timing_path(profile.platform, directory)
+    with open(path, 'w') as f:
+        json.dump(profile.as_dict(), f, indent=2)
+
+    return path
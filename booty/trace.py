@@ -0,0 +1,104 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+    """
+    Records a timeline of the session as Chrome/Perfetto trace events.
+
+    Events are held in a ring buffer of ``max_events`` entries so that the
+    memory overhead stays bounded; when the buffer is full, the oldest
+    events are dropped.  A disabled tracer accepts all calls and records
+    nothing.
+    """
+    def __init__(self, max_events=100000, enabled=True):
+        self.enabled = enabled
+        self.dropped = 0
+
+        self._events = collections.deque(maxlen=max_events)
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._start_time = time.perf_counter()
+
+    def _timestamp(self, t=None):
+        t = time.perf_counter() if t is None else t
+        return (t - self._start_time) * 1e6
+
+    def _append(self, event):
+        tid = threading.get_ident()
+        event['pid'] = self._pid
+        event['tid'] = tid
+
+        with self._lock:
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+
+    def complete(self, name, start, end=None, category='booty', **args):
+        """
+        Record a span which has already finished
+        :param name: the name of the span
+        :param start: the ``time.perf_counter()`` value at which the span started
+        :param end: the ``time.perf_counter()`` value at which the span ended, defaults to now
+        :param category: the trace category
+        :param args: additional values to attach to the span
+        :return: None
+        """
+        if not self.enabled:
+            return
+
+        end = time.perf_counter() if end is None else end
+        self._append({
+            'name': name, 'cat': category, 'ph': 'X',
+            'ts': self._timestamp(start), 'dur': (end - start) * 1e6,
+            'args': args
+        })
+
+    @contextlib.contextmanager
+    def span(self, name, category='booty', **args):
+        """
+        Context manager which records the enclosed block as a span
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, start, category=category, **args)
+
+    @property
+    def events(self):
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in threads.items()
+        ]
+
+        return metadata + events
+
+    def write(self, path):
+        """
+        Write the trace to a file which may be opened in ``chrome://tracing`` or Perfetto
+        :param path: the path of the file
+        :return: None
+        """
+        with open(path, 'w') as f:
+            json.dump({
+                'traceEvents': self.events,
+                'displayTimeUnit': 'ms',
+                'otherData': {'dropped_events': self.dropped}
+            }, f)
@@ -0,0 +1,219 @@
+import logging
+import socket
+import threading
+import time
+
+import serial
+
+from booty.simulator import SimulatedDevice, SimulatedPort
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class SocketPort:
+    """
+    Raw TCP connection to a serial-to-Ethernet bridge, presenting the subset of
+    the ``serial.Serial`` interface used by the ``Framer``.  Nagle's algorithm is
+    disabled so that frames are not held back waiting for acknowledgements, and
+    incoming data is received by a thread blocked on the socket instead of by
+    polling it.
+    """
+    def __init__(self, host, port, baudrate=115200, timeout=5.0):
+        self.port = 'tcp://{}:{}'.format(host, port)
+        self.baudrate = baudrate
+
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.settimeout(None)
+
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        while not self._closed:
+            try:
+                data = self._socket.recv(4096)
+            except OSError:
+                data = b''
+
+            if not data:
+                if not self._closed:
+                    logger.error('connection to {} closed'.format(self.port))
+                self._closed = True
+                return
+
+            with self._lock:
+                self._buffer += data
+
+    @property
+    def is_open(self):
+        return not self._closed
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def read(self, size=1):
+        """
+        Read up to ``size`` bytes which have already been received
+        """
+        with self._lock:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def write(self, data):
+        if self._closed:
+            raise serial.SerialException('connection to {} closed'.format(self.port))
+
+        self._socket.sendall(bytes(data))
+        return len(data)
+
+    def close(self):
+        self._closed = True
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+
+class CoalescingPort:
+    """
+    Wraps a port so that writes issued in quick succession, such as a burst of
+    pipelined frames, are combined into a single large write.  Writes return
+    immediately; a writer thread waits ``delay`` seconds after the first write
+    of a burst and then writes everything that has accumulated, up to
+    ``max_size`` bytes at a time.  If a write to the wrapped port fails, the
+    writer thread stops and the error is raised by the next ``write`` or
+    ``flush``.  All other attributes are forwarded to the wrapped port.
+    """
+    def __init__(self, port, delay=0.0005, max_size=8192):
+        self._port = port
+        self._delay = delay
+        self._max_size = max_size
+
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+        self._writing = False
+        self._closed = False
+        self._error = None
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def __getattr__(self, item):
+        return getattr(self._port, item)
+
+    @property
+    def baudrate(self):
+        return self._port.baudrate
+
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        # data already written must leave at the previous rate
+        self.flush()
+        self._port.baudrate = baudrate
+
+    @property
+    def in_waiting(self):
+        return self._port.in_waiting
+
+    def read(self, size=1):
+        return self._port.read(size)
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while not self._buffer and not self._closed:
+                    self._condition.wait()
+
+                if self._closed and not self._buffer:
+                    return
+
+            # give the rest of the burst a chance to arrive
+            time.sleep(self._delay)
+
+            with self._condition:
+                chunk = bytes(self._buffer[:self._max_size])
+                del self._buffer[:self._max_size]
+                self._writing = True
+
+            try:
+                self._port.write(chunk)
+            except Exception as e:
+                logger.error('write to {} failed: {}'.format(getattr(self._port, 'port', 'port'), e))
+                with self._condition:
+                    self._error = e
+                    self._writing = False
+                    self._condition.notify_all()
+                return
+
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, data):
+        with self._condition:
+            self._raise_error()
+            self._buffer += data
+            self._condition.notify_all()
+
+        return len(data)
+
+    def flush(self):
+        """
+        Block until all buffered data has been written to the wrapped port
+        """
+        with self._condition:
+            while (self._buffer or self._writing) and self._error is None:
+                self._condition.wait()
+
+            self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            self._port.close()
+
+
+def open_port(url, baudrate=115200):
+    """
+    Opens the transport for a port name or URL:
+
+     * ``tcp://host:port`` - raw TCP socket to a serial-to-Ethernet bridge
+     * ``rfc2217://host:port`` - RFC2217 (telnet COM port control) bridge
+     * ``sim://platform`` - simulated device, such as ``sim://dspic33ep32mc204``
+     * anything else - local serial port, such as ``COM20`` or ``/dev/ttyUSB0``
+
+    Network transports coalesce bursts of writes into large writes.
+    :param url: the port name or URL
+    :param baudrate: the baud rate of the serial line
+    :return: the port
+    """
+    if url.startswith('tcp://'):
+        host, _, port = url[len('tcp://'):].rpartition(':')
+        return CoalescingPort(SocketPort(host, int(port), baudrate=baudrate))
+
+    if url.startswith('rfc2217://'):
+        return CoalescingPort(serial.serial_for_url(url, baudrate=baudrate))
+
+    if url.startswith('sim://'):
+        platform = url[len('sim://'):] or 'dspic33ep32mc204'
+        return SimulatedPort(SimulatedDevice(platform), baudrate=baudrate)
+
+    return serial.Serial(url, baudrate=baudrate)
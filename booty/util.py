@@ -1,8 +1,14 @@
 import logging
+import os
+import queue
+import struct
 import time
 
-from booty.hex import HexParser
-from booty.comm_thread import BootLoaderThread
+from booty.hex import HexParser, HexWriter, AddressSegment
+from booty.comm_thread import BootLoaderThread, BLANK_CHECK_MAX_PAGES, ERASE_PAGE, WRITE_ROW, WRITE_MAX, \
+    COMMAND_NAMES, address_command
+from booty.timing import TimingProfile
+from booty.transport import open_port
 import serial
 
 logger = logging.getLogger(__name__)
@@ -10,11 +16,23 @@ logger.setLevel(logging.INFO)
 
 
 def create_serial_port(port_name, baud_rate=115200):
-    return serial.Serial(port_name, baudrate=baud_rate)
+    return open_port(port_name, baud_rate)
 
 
-def create_blt(port):
-    return BootLoaderThread(port)
+def create_blt(port, tracer=None, max_batch=1):
+    return BootLoaderThread(port, tracer=tracer, max_batch=max_batch)
+
+
+def parse_hex(hex_file):
+    """
+    Parses a hex file, unless it has already been parsed
+    :param hex_file: the path to the hex file or a ``HexParser``
+    :return: a ``HexParser``
+    """
+    if isinstance(hex_file, HexParser):
+        return hex_file
+
+    return HexParser(hex_file)
 
 
 def bitwise_not(n, width=32):
@@ -38,85 +56,611 @@ def identify_device(boot_loader_app, timeout=5.0):
     return True
 
 
-def erase_device(boot_loader_app):
-    logger.info('erasing device...')
+def parse_range(text):
+    """
+    Parses an address range such as ``0x1000:0x2000``; the end address is exclusive
+    :param text: the range as ``START:END``, with each address in decimal or prefixed hex
+    :return: a tuple containing the start and end addresses
+    """
+    try:
+        start, end = (int(a, 0) for a in text.split(':'))
+    except ValueError:
+        raise ValueError('invalid range "{}", expected START:END'.format(text))
+
+    if end <= start:
+        raise ValueError('invalid range "{}", the end must follow the start'.format(text))
+
+    return start, end
+
+
+def parse_patch(text):
+    """
+    Parses a word patch such as ``0x800ff8=0x001234``
+    :param text: the patch as ``ADDRESS=VALUE``, with each number in decimal or prefixed hex
+    :return: a tuple containing the address and the value
+    """
+    try:
+        address, value = (int(a, 0) for a in text.split('='))
+    except ValueError:
+        raise ValueError('invalid patch "{}", expected ADDRESS=VALUE'.format(text))
+
+    if address % 2 != 0:
+        raise ValueError('invalid patch "{}", the address must be even'.format(text))
+
+    return address, value
+
+
+def range_pages(boot_loader_app, ranges):
+    """
+    Determines the pages which cover a set of address ranges.  Only the first page
+    and the pages of the application space are included, so that the boot loader
+    itself is never erased.
+    :param boot_loader_app: the identified boot loader, or a device profile with the same attributes
+    :param ranges: a sequence of (start, end) address tuples
+    :return: a sorted list of page addresses
+    """
+    page_size = boot_loader_app.page_length << 1
+
+    pages = set()
+    for start, end in ranges:
+        page = start & bitwise_not(page_size - 1)
+        while page < end:
+            if page == 0 or boot_loader_app.app_start_addr <= page < boot_loader_app.prog_length:
+                pages.add(page)
+            else:
+                logger.warning('page {:06X} is outside of the application space, skipping'.format(page))
+            page += page_size
+
+    return sorted(pages)
+
+
+def erase_addresses(boot_loader_app, ranges=None):
+    """
+    Generates the address of every page erase required to erase the application space
+    :param boot_loader_app: the identified boot loader, or a device profile with the same attributes
+    :param ranges: when given, only erase the pages covering these (start, end) address ranges
+    :return: a generator of addresses
+    """
+    if ranges:
+        yield from range_pages(boot_loader_app, ranges)
+        return
 
     highest_prog_address = boot_loader_app.prog_length - boot_loader_app.page_length
     last_prog_page = highest_prog_address & bitwise_not(boot_loader_app.page_length - 1)
+    page_size = boot_loader_app.page_length << 1
 
-    # erase first page, program first page
-    address = 0
-    boot_loader_app.erase_page(address)
-    logger.debug('erasing first page...')
+    # first page
+    yield 0
 
+    # one erase per page; the bound leaves the last page, which holds the configuration words
     address = boot_loader_app.app_start_addr
     while address < last_prog_page:
+        yield address
+        address += page_size
+
+
+def _page_runs(pages, page_size):
+    """
+    Groups pages into runs of consecutive pages, each no longer than ``BLANK_CHECK_MAX_PAGES``
+    :return: a list of (first page, number of pages) tuples
+    """
+    runs = []
+    for page in sorted(set(pages)):
+        if runs and page == runs[-1][0] + runs[-1][1] * page_size and runs[-1][1] < BLANK_CHECK_MAX_PAGES:
+            runs[-1][1] += 1
+        else:
+            runs.append([page, 1])
+
+    return [tuple(run) for run in runs]
+
+
+def _wait_until(boot_loader_app, condition, timeout):
+    """
+    Waits for the transmit queue to empty and then for a condition, for up to ``timeout`` more seconds
+    :return: True if the condition was met, else False
+    """
+    while boot_loader_app.busy and not boot_loader_app.end:
+        time.sleep(0.01)
+
+    start_time = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start_time > timeout or boot_loader_app.end:
+            return False
+        time.sleep(0.01)
+
+    return True
+
+
+def _read_blank_pages(boot_loader_app, pages, timeout):
+    """
+    Reads every row of each page using ``READ_MAX``
+    :return: the set of pages of which every row was read and is blank
+    """
+    row_size = boot_loader_app.max_prog_size << 1
+    page_size = boot_loader_app.page_length << 1
+    blank = [0xffffff] * boot_loader_app.max_prog_size
+
+    rows = {}
+    boot_loader_app.read_handler = lambda address, opcodes: rows.__setitem__(address, opcodes)
+
+    page_rows = {page: range(page, page + page_size, row_size) for page in pages}
+    try:
+        for page in pages:
+            for address in page_rows[page]:
+                boot_loader_app.read_page(address)
+
+        _wait_until(boot_loader_app, lambda: all(a in rows for r in page_rows.values() for a in r), timeout)
+    finally:
+        boot_loader_app.read_handler = None
+
+    return {page for page, addresses in page_rows.items()
+            if all([opcode & 0xffffff for opcode in rows.get(address, [])] == blank for address in addresses)}
+
+
+def blank_pages(boot_loader_app, pages, read=True, timeout=0.3):
+    """
+    Determines which pages are already blank, so that erasing them may be skipped.
+    Pages which the mirror of the boot loader knows to be blank, such as those
+    erased earlier in the session, are not checked again.  For the others, the
+    device is asked using ``BLANK_CHECK``, which covers every opcode of each
+    page.  Devices which do not respond to ``BLANK_CHECK`` have every row of
+    each page read instead, but only when reading a page is quicker than
+    erasing it at the current baud rate.
+    Once a device has not responded, it is not asked again until it is identified again.
+    :param boot_loader_app: the identified boot loader
+    :param pages: the page addresses
+    :param read: when False, devices without ``BLANK_CHECK`` have every page erased
+    :param timeout: the time to wait for the responses, in seconds
+    :return: the set of page addresses which are blank
+    """
+    page_length = boot_loader_app.page_length
+    known = {page for page in pages if boot_loader_app.mirror.blank(page, page_length)}
+
+    pages = sorted(set(pages) - known)
+    if not pages:
+        return known
+
+    if boot_loader_app.blank_check_supported is not False:
+        page_size = boot_loader_app.page_length << 1
+        results = boot_loader_app.blank_check_results
+        results.clear()
+
+        for address, count in _page_runs(pages, page_size):
+            boot_loader_app.blank_check(address, count)
+
+        _wait_until(boot_loader_app, lambda: all(page in results for page in pages), timeout)
+        if results:
+            # pages without a response are treated as not blank
+            return known | {page for page in pages if results.get(page)}
+
+        boot_loader_app.blank_check_supported = False
+
+    logger.info('device does not support blank checks')
+    if not read:
+        return known
+
+    baudrate = boot_loader_app.baudrate
+    timing = boot_loader_app.timing
+    rows_per_page = boot_loader_app.page_length // boot_loader_app.max_prog_size
+    read_time = rows_per_page * timing.delay('read_page', baudrate, boot_loader_app.max_prog_size / 128)
+    if read_time >= timing.delay('erase_page', baudrate):
+        logger.info('reading a page is slower than erasing it at {} bits/s'.format(baudrate))
+        return known
+
+    return known | _read_blank_pages(boot_loader_app, pages, timeout)
+
+
+def erase_device(boot_loader_app, ranges=None, skip_blank=False):
+    """
+    Erases the application space of the device
+    :param boot_loader_app: the identified boot loader
+    :param ranges: when given, only erase the pages covering these (start, end) address ranges
+    :param skip_blank: when True, pages which are already blank are not erased
+    :return: True, or False if the boot loader thread failed
+    """
+    logger.info('erasing device...')
+    tracer = boot_loader_app.tracer
+    start_time = time.perf_counter()
+
+    addresses = list(erase_addresses(boot_loader_app, ranges))
+    if skip_blank:
+        with tracer.span('blank check', pages=len(addresses)):
+            blank = blank_pages(boot_loader_app, addresses)
+        logger.info('{} of {} pages are blank, skipping'.format(len(blank), len(addresses)))
+        addresses = [address for address in addresses if address not in blank]
+
+    for address in addresses:
         boot_loader_app.erase_page(address)
         logger.debug('erasing {} page...'.format(hex(address)))
-        address += boot_loader_app.page_length
 
     # wait for all transmissions are complete
     while boot_loader_app.busy:
         time.sleep(0.2)
         logger.info('erase operations remaining: {}'.format(boot_loader_app.transactions_remaining))
 
+    tracer.complete('erase_device', start_time)
+    if boot_loader_app.error is not None:
+        logger.error('erasure failed: {}'.format(boot_loader_app.error))
+        return False
+
     logger.info('erasure complete!')
 
     return True
 
 
-def load_hex(boot_loader_app, hex_file_path):
-    logger.info('loading device...')
+def write_addresses(boot_loader_app, ranges=None):
+    """
+    Generates the address of every ``WRITE_MAX`` operation required to load the device
+    :param boot_loader_app: the identified boot loader, or a device profile with the same attributes
+    :param ranges: when given, only write the pages covering these (start, end) address ranges
+    :return: a generator of addresses
+    """
+    write_length = boot_loader_app.max_prog_size << 1
 
-    hp = HexParser(hex_file_path)
+    if ranges:
+        page_size = boot_loader_app.page_length << 1
+        for page in range_pages(boot_loader_app, ranges):
+            for offset in range(0, page_size, write_length):
+                yield page + offset
+        return
 
-    # calculate some useful constants
-    prog_ops_per_erase = int(boot_loader_app.page_length / boot_loader_app.max_prog_size)
     highest_prog_address = boot_loader_app.prog_length - boot_loader_app.page_length
     last_prog_page = highest_prog_address & bitwise_not(boot_loader_app.page_length - 1)
 
-    # erase first page, program first page
-    address = 0
+    # first page
+    prog_ops_per_erase = int(boot_loader_app.page_length / boot_loader_app.max_prog_size)
     for i in range(prog_ops_per_erase):
-        row_data = [hp.get_opcode(addr + (i * boot_loader_app.max_prog_size)) for addr in range(boot_loader_app.max_prog_size * 2) if addr % 2 == 0]
-        logger.debug('writing first page...')
-        boot_loader_app.write_max(address + len(row_data) * i, row_data)
+        yield i * write_length
 
     address = boot_loader_app.app_start_addr
     while address < last_prog_page:
-        row_data = [hp.get_opcode(addr + address) for addr in range(boot_loader_app.max_prog_size * 2) if addr % 2 == 0]
+        yield address
+        address += write_length
+
+
+def iter_writes(boot_loader_app, hex_file_path, baudrate=115200, timing=None, ranges=None):
+    """
+    Chooses the commands which write an image, one region of ``max_prog_size``
+    opcodes at a time.  Regions which are blank are left out, as the erased
+    flash already holds 0xffffff.  Otherwise, the region is written either as
+    a single ``WRITE_MAX``, padded with 0xffffff, or as one ``WRITE_ROW`` for
+    each row of ``row_length`` opcodes which holds data, whichever has the
+    shorter estimated time at the baud rate.  The estimate is the delay of each
+    command, which covers both the transfer and the time spent by the device.
+    :param boot_loader_app: the identified boot loader, or a device profile with the same attributes
+    :param hex_file_path: the path to the hex file or a ``HexParser``
+    :param baudrate: the baud rate that the image will be written at
+    :param timing: the ``TimingProfile`` used for the estimates, defaults to the default timing
+    :param ranges: when given, only write the pages covering these (start, end) address ranges
+    :return: a generator of (command, address, opcodes, estimated time) tuples
+    """
+    timing = timing if timing is not None else TimingProfile()
+    hp = parse_hex(hex_file_path)
+
+    row_length = boot_loader_app.row_length
+    max_prog_size = boot_loader_app.max_prog_size
+
+    write_row_cost = timing.delay('write_row', baudrate)
+    write_max_cost = timing.delay('write_max', baudrate, max_prog_size)
+
+    for address in write_addresses(boot_loader_app, ranges):
+        opcodes = hp.get_opcodes(address, max_prog_size)
+
+        rows = [i for i in range(0, max_prog_size, row_length)
+                if any(opcode & 0xffffff != 0xffffff for opcode in opcodes[i:i + row_length])]
+        if not rows:
+            continue
+
+        if len(rows) * write_row_cost < write_max_cost:
+            for i in rows:
+                yield WRITE_ROW, address + 2 * i, opcodes[i:i + row_length], write_row_cost
+        else:
+            yield WRITE_MAX, address, opcodes, write_max_cost
+
+
+class WritePlan:
+    """
+    The commands chosen by ``iter_writes`` to write an image, kept so that the
+    plan and its estimated time may be inspected before it is used
+    """
+    def __init__(self, entries, baudrate, full_cost):
+        """
+        :param entries: a list of (command, address, opcodes, estimated time) tuples
+        :param baudrate: the baud rate that the estimates are for
+        :param full_cost: the estimated time of writing every region using ``WRITE_MAX``
+        """
+        self.entries = entries
+        self.baudrate = baudrate
+        self.full_cost = full_cost
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def cost(self):
+        """
+        :return: the estimated time of the plan, in seconds
+        """
+        return sum(cost for _, _, _, cost in self.entries)
+
+    @property
+    def opcodes(self):
+        """
+        :return: the number of opcodes transmitted, including padding
+        """
+        return sum(len(opcodes) for _, _, opcodes, _ in self.entries)
+
+    def counts(self):
+        """
+        :return: a dict of command name to the number of times it is used
+        """
+        counts = {}
+        for command, _, _, _ in self.entries:
+            name = COMMAND_NAMES[command]
+            counts[name] = counts.get(name, 0) + 1
+
+        return counts
+
+    def __str__(self):
+        return '{} at {} bits/s, {} opcodes, estimated {:.2f}s (WRITE_MAX only: {:.2f}s)'.format(
+            ', '.join('{} x {}'.format(n, name) for name, n in sorted(self.counts().items())) or 'no writes',
+            self.baudrate, self.opcodes, self.cost, self.full_cost)
+
+
+def plan_writes(boot_loader_app, hex_file_path, baudrate=115200, timing=None, ranges=None):
+    """
+    Plans the commands which write an image, as chosen by ``iter_writes``
+    :param boot_loader_app: the identified boot loader, or a device profile with the same attributes
+    :param hex_file_path: the path to the hex file or a ``HexParser``
+    :param baudrate: the baud rate that the image will be written at
+    :param timing: the ``TimingProfile`` used for the estimates, defaults to the default timing
+    :param ranges: when given, only write the pages covering these (start, end) address ranges
+    :return: a ``WritePlan``
+    """
+    timing = timing if timing is not None else TimingProfile()
+
+    entries = list(iter_writes(boot_loader_app, hex_file_path, baudrate, timing, ranges))
+    full_cost = len(list(write_addresses(boot_loader_app, ranges))) * \
+        timing.delay('write_max', baudrate, boot_loader_app.max_prog_size)
+
+    return WritePlan(entries, baudrate, full_cost)
+
+
+def load_hex(boot_loader_app, hex_file_path, buffer_size=8, ranges=None):
+    """
+    Loads the device with the contents of a hex file, using the commands
+    chosen by ``iter_writes``.  Frames are produced lazily on the calling
+    thread while the boot loader thread transmits them, with no more than
+    ``buffer_size`` frames waiting at any time so that memory use does not
+    depend upon the size of the image.
+    :param boot_loader_app: the identified boot loader
+    :param hex_file_path: the path to the hex file or a ``HexParser``
+    :param buffer_size: the maximum number of frames waiting to be transmitted
+    :param ranges: when given, only write the pages covering these (start, end) address ranges
+    :return: True, or False if the boot loader thread failed
+    """
+    logger.info('loading device...')
+    tracer = boot_loader_app.tracer
+    start_time = time.perf_counter()
 
-        logger.debug('writing to {}...'.format(hex(address)))
+    with tracer.span('parse hex', path=str(hex_file_path)):
+        hp = parse_hex(hex_file_path)
 
-        boot_loader_app.write_max(address, row_data)
-        address += boot_loader_app.max_prog_size << 1
+    writes = iter_writes(boot_loader_app, hp, boot_loader_app.baudrate, boot_loader_app.timing, ranges)
+    while True:
+        boot_loader_app.wait_for_queue_space(buffer_size)
+
+        with tracer.span('build row'):
+            write = next(writes, None)
+        if write is None:
+            break
+
+        command, address, opcodes, _ = write
+        logger.debug('writing to {}...'.format(hex(address)))
+        if command == WRITE_ROW:
+            boot_loader_app.write_row(address, opcodes)
+        else:
+            boot_loader_app.write_max(address, opcodes)
 
     # wait for all transmissions are complete
     while boot_loader_app.busy:
         time.sleep(0.2)
         logger.info('write operations remaining: {}'.format(boot_loader_app.transactions_remaining))
 
+    tracer.complete('load_hex', start_time)
+    if boot_loader_app.error is not None:
+        logger.error('loading failed: {}'.format(boot_loader_app.error))
+        return False
+
     logger.info('loading complete!')
 
     return True
 
 
-def verify_hex(boot_loader_app, hex_file_path, retries=3, whitelist_addresses=(0x000000,)):
+def _overlapped_schedule(erases, writes, page_size):
+    """
+    Orders erases and writes so that the erase of each page is sent just
+    before the rows of the previous page
+    :param erases: the page addresses to erase
+    :param writes: the writes from ``iter_writes``, in address order
+    :return: a generator of (command, address, opcodes, estimated time) tuples, with None opcodes for erases
+    """
+    erases = sorted(erases)
+    i = 0
+    current = None
+
+    for write in writes:
+        page = write[1] - write[1] % page_size
+        if page != current:
+            current = page
+
+            # the page must be erased before its rows are written...
+            while i < len(erases) and erases[i] <= page:
+                yield ERASE_PAGE, erases[i], None, None
+                i += 1
+
+            # ...and the next page is erased while they are transmitted
+            if i < len(erases):
+                yield ERASE_PAGE, erases[i], None, None
+                i += 1
+
+        yield write
+
+    for page in erases[i:]:
+        yield ERASE_PAGE, page, None, None
+
+
+def erase_and_load(boot_loader_app, hex_file_path, buffer_size=8, ranges=None, skip_blank=False):
+    """
+    Erases and loads the device page by page.  The erase of each page is sent
+    ahead of the rows of the previous page, and the wait after it is shortened
+    by the time the first of those rows takes to arrive, so that the device
+    erases while the host transmits.  The row must not be complete before the
+    erase is, so this relies on the device receiving into a buffer while it
+    erases, as the simulator does.  Devices which stall their UART during an
+    erase lose rows, which ``verify_hex`` will report.
+    :param boot_loader_app: the identified boot loader
+    :param hex_file_path: the path to the hex file or a ``HexParser``
+    :param buffer_size: the maximum number of frames waiting to be transmitted
+    :param ranges: when given, only erase and write the pages covering these (start, end) address ranges
+    :param skip_blank: when True, pages which are already blank are not erased
+    :return: True, or False if the boot loader thread failed
+    """
+    logger.info('erasing and loading device...')
+    tracer = boot_loader_app.tracer
+    start_time = time.perf_counter()
+
+    with tracer.span('parse hex', path=str(hex_file_path)):
+        hp = parse_hex(hex_file_path)
+
+    baudrate = boot_loader_app.baudrate
+    page_size = boot_loader_app.page_length << 1
+
+    erases = list(erase_addresses(boot_loader_app, ranges))
+    if skip_blank:
+        with tracer.span('blank check', pages=len(erases)):
+            blank = blank_pages(boot_loader_app, erases)
+        logger.info('{} of {} pages are blank, skipping'.format(len(blank), len(erases)))
+        erases = [address for address in erases if address not in blank]
+
+    writes = iter_writes(boot_loader_app, hp, baudrate, boot_loader_app.timing, ranges)
+    schedule = _overlapped_schedule(erases, writes, page_size)
+    erase_wait = boot_loader_app.timing.delay('erase_page', baudrate)
+
+    entry = next(schedule, None)
+    while entry is not None:
+        boot_loader_app.wait_for_queue_space(buffer_size)
+
+        with tracer.span('build row'):
+            following = next(schedule, None)
+
+        command, address, opcodes, _ = entry
+        if command == ERASE_PAGE:
+            wait = erase_wait
+            if following is not None and following[0] != ERASE_PAGE:
+                # command, address, opcodes and the framing, at 10 bits per byte
+                arrival = (5 + 4 * len(following[2]) + 6) * 10 / baudrate
+                wait = max(0.0, erase_wait - arrival)
+
+            logger.debug('erasing {} page...'.format(hex(address)))
+            boot_loader_app.add_to_queue(address_command(ERASE_PAGE, address), wait, address=address)
+
+        elif command == WRITE_ROW:
+            logger.debug('writing to {}...'.format(hex(address)))
+            boot_loader_app.write_row(address, opcodes)
+
+        else:
+            logger.debug('writing to {}...'.format(hex(address)))
+            boot_loader_app.write_max(address, opcodes)
+
+        entry = following
+
+    # wait for all transmissions are complete
+    while boot_loader_app.busy:
+        time.sleep(0.2)
+        logger.info('operations remaining: {}'.format(boot_loader_app.transactions_remaining))
+
+    tracer.complete('erase_and_load', start_time)
+    if boot_loader_app.error is not None:
+        logger.error('erasure and loading failed: {}'.format(boot_loader_app.error))
+        return False
+
+    logger.info('erasure and loading complete!')
+
+    return True
+
+
+def _clip_segments(segments, pages, page_size):
+    """
+    Restricts address segments to a set of pages
+    :return: a list of ``AddressSegment``
+    """
+    clipped = []
+    for segment in segments:
+        for page in pages:
+            start = max(segment.start, page)
+            end = min(segment.end, page + page_size)
+            if start < end:
+                clipped.append(AddressSegment(start, end))
+
+    return clipped
+
+
+def verify_hex(boot_loader_app, hex_file_path, retries=3, whitelist_addresses=(0x000000,), ranges=None,
+               overrides=None):
+    """
+    Reads the device back and compares it with a hex file
+    :param boot_loader_app: the identified boot loader
+    :param hex_file_path: the path to the hex file or a ``HexParser``
+    :param retries: the number of times to wait for a row which has not been received
+    :param whitelist_addresses: addresses which are not verified
+    :param ranges: when given, only verify the pages covering these (start, end) address ranges
+    :param overrides: a dict of address to the opcode expected in place of the hex file contents, such as
+        the patches loaded using ``PreparedImage.patched``
+    :return: True if the device matches
+    """
     okay_so_far = True
+    overrides = overrides if overrides is not None else {}
+    tracer = boot_loader_app.tracer
+    start_time = time.perf_counter()
 
-    hp = HexParser(hex_file_path)
+    with tracer.span('parse hex', path=str(hex_file_path)):
+        hp = parse_hex(hex_file_path)
 
+    segments = hp.segments
+    if ranges:
+        segments = _clip_segments(segments, range_pages(boot_loader_app, ranges), boot_loader_app.page_length << 1)
+
+    # overridden words outside of the image, such as a serial number in an otherwise blank row, are verified as well
+    row_size = boot_loader_app.max_prog_size << 1
+    extra_rows = sorted({address - address % row_size for address in overrides
+                         if not any(segment.start <= address < segment.end for segment in segments)})
+    segments = list(segments) + [AddressSegment(row, row + row_size) for row in extra_rows]
+
+    # rows which have been read back since they were last erased or written are not read again
     logger.info('reading flash from device...')
-    for segment in hp.segments:
+    mirror = boot_loader_app.mirror
+    cached = 0
+    for segment in segments:
         for addr in range(segment.start, segment.end, boot_loader_app.max_prog_size):
             if addr >= boot_loader_app.prog_length:
                 continue
+            if mirror.confirmed(addr, boot_loader_app.max_prog_size):
+                cached += 1
+                continue
             logger.debug('reading address {:06X}'.format(addr))
             boot_loader_app.read_page(addr)
 
+    if cached:
+        logger.info('{} rows already known, not read again'.format(cached))
+
     logger.info('verifying....')
-    for segment in hp.segments:
+    for segment in segments:
         logger.info('verifying segment {}'.format(segment))
+        segment_start_time = time.perf_counter()
 
         for addr in range(segment.start, segment.end, 2):
             if addr in whitelist_addresses:
@@ -126,27 +670,127 @@ def verify_hex(boot_loader_app, hex_file_path, retries=3, whitelist_addresses=(0
                 logger.debug('address {:06X} is beyond the programming upper bound, skipping verification'.format(addr))
                 continue
 
-            m = None
+            m = boot_loader_app.get_opcode(addr)
             for retry in range(retries):
-                m = boot_loader_app.get_opcode(addr)
                 if m is not None:
                     break
                 logger.debug('address {:06X} not yet loaded'.format(addr))
                 time.sleep(0.2)
+                m = boot_loader_app.get_opcode(addr)
             if m is None:
                 logger.error('aborting verification. Could not read address {:06X}.'.format(addr))
+                tracer.complete('verify_hex', start_time, result=False)
                 return False
 
             m = m & 0xffffff
-            h = hp.get_opcode(addr) & 0xffffff
+            h = overrides[addr] if addr in overrides else hp.get_opcode(addr)
+            h = h & 0xffffff
             if m != h:
                 logger.error('address {:06X}: device value "{:06X}" does not match hex value "{:06X}"'.format(addr, m, h))
                 okay_so_far = False
 
+        tracer.complete('verify segment', segment_start_time, segment=str(segment))
+
+    tracer.complete('verify_hex', start_time, result=okay_so_far)
     logger.info('verification complete!')
     return okay_so_far
 
 
+def dump_flash(boot_loader_app, path, buffer_size=8, retries=3, timeout=1.0):
+    """
+    Reads the program memory of the device into an Intel HEX (``.hex``) or
+    binary (``.bin``) file.  Rows are requested in a pipeline of no more than
+    ``buffer_size`` reads and written to the file as each response is decoded,
+    so memory use does not depend upon the size of the device.  Rows which
+    were not received are requested again.  Blank rows are left out of hex files.
+    :param boot_loader_app: the identified boot loader
+    :param path: the path of the file to create
+    :param buffer_size: the maximum number of reads waiting to be transmitted
+    :param retries: the number of times that missing rows are requested again
+    :param timeout: the time to wait for outstanding responses, in seconds
+    :return: True if every row was read, else False
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ('.hex', '.bin'):
+        raise ValueError('unsupported dump format "{}", expected .hex or .bin'.format(extension))
+
+    logger.info('dumping flash to "{}"...'.format(path))
+    tracer = boot_loader_app.tracer
+    start_time = time.perf_counter()
+
+    row_length = boot_loader_app.max_prog_size
+    row_size = row_length << 1
+    missing = set(range(0, boot_loader_app.prog_length, row_size))
+    blank = [0xffffff] * row_length
+
+    responses = queue.Queue()
+    boot_loader_app.read_handler = lambda address, opcodes: responses.put((address, opcodes))
+
+    if extension == '.hex':
+        writer = HexWriter(path)
+    else:
+        writer = open(path, 'wb')
+        writer.truncate(len(missing) * row_length * 4)
+
+    def drain(wait=0.0):
+        while True:
+            try:
+                address, opcodes = responses.get(timeout=wait)
+            except queue.Empty:
+                return
+
+            if address not in missing or len(opcodes) != row_length:
+                continue
+
+            missing.discard(address)
+            opcodes = [opcode & 0xffffff for opcode in opcodes]
+
+            if extension == '.hex':
+                if opcodes != blank:
+                    writer.write_opcodes(address, opcodes)
+            else:
+                writer.seek(address << 1)
+                writer.write(struct.pack('<{}I'.format(row_length), *opcodes))
+
+    try:
+        # rows which have been read back since they were last erased or written are taken from the mirror
+        for address in sorted(missing):
+            if boot_loader_app.mirror.confirmed(address, row_length):
+                responses.put((address, [boot_loader_app.get_opcode(address + 2 * i) for i in range(row_length)]))
+        drain()
+
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                logger.info('requesting {} missing rows again...'.format(len(missing)))
+
+            for address in sorted(missing):
+                boot_loader_app.wait_for_queue_space(buffer_size)
+                boot_loader_app.read_page(address)
+                drain()
+
+            while boot_loader_app.busy and not boot_loader_app.end:
+                drain(0.05)
+
+            # wait for the last responses, until nothing arrives for the timeout
+            drain(timeout)
+
+            if not missing:
+                break
+
+    finally:
+        boot_loader_app.read_handler = None
+        writer.close()
+
+    tracer.complete('dump_flash', start_time, rows_missing=len(missing))
+
+    if missing:
+        logger.error('could not read {} rows, starting at {:06X}'.format(len(missing), min(missing)))
+        return False
+
+    logger.info('dump complete!')
+    return True
+
+
 if __name__ == '__main__':
     hex_path = 'C:/_code/libs/blink.X/dist/default/production/blink.X.production.hex'
 
@@ -0,0 +1,17 @@
+import pytest
+from intelhex import IntelHex
+
+
+@pytest.fixture
+def hex_file(tmp_path):
+    """
+    A small application image of two pages starting at 0x1000, each word holding three times its address
+    """
+    ih = IntelHex()
+    for address in range(0x1000, 0x1800, 2):
+        for i, b in enumerate(((address * 3) & 0xffffff).to_bytes(4, 'little')):
+            ih[(address << 1) + i] = b
+
+    path = tmp_path / 'image.hex'
+    ih.write_hex_file(str(path))
+    return str(path)
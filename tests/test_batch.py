@@ -0,0 +1,36 @@
+import pytest
+
+from booty.comm_thread import BootLoaderThread
+from booty.simulator import SimulatedPort
+from booty.util import create_blt, erase_device, load_hex, verify_hex
+
+
+def test_unbatched_by_default(hex_file):
+    # a device without flow control which handles one command at a time
+    port = SimulatedPort(busy=True, receive_buffer=1)
+    blt = create_blt(port)
+    assert blt.max_batch == 1
+    assert blt.device_identified
+
+    assert erase_device(blt)
+    assert load_hex(blt, hex_file)
+    assert verify_hex(blt, hex_file)
+    assert port.dropped == 0
+
+    blt.end_thread()
+
+
+@pytest.mark.parametrize('receive_buffer, identified', [(1, False), (8, True)])
+def test_batching_requires_buffering_device(hex_file, receive_buffer, identified):
+    port = SimulatedPort(busy=True, receive_buffer=receive_buffer)
+    blt = BootLoaderThread(port, timing_directory=None, max_batch=8)
+    assert blt.device_identified == identified
+    assert (port.dropped == 0) == identified
+
+    if identified:
+        assert erase_device(blt)
+        assert load_hex(blt, hex_file)
+        assert verify_hex(blt, hex_file)
+        assert port.dropped == 0
+
+    blt.end_thread()
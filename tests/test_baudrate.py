@@ -0,0 +1,37 @@
+import pytest
+
+from booty.simulator import SimulatedPort, SimulatedDevice
+from booty.util import create_blt, erase_device, load_hex, verify_hex
+
+
+@pytest.mark.parametrize('port_options, device_options, expected', [
+    ({}, {}, 921600),
+    # the line cannot carry the fastest rate, so the next one is used
+    ({'max_line_rate': 460800}, {}, 460800),
+    ({}, {'baud_rates': (115200, 230400)}, 230400),
+    # the device does not answer READ_BAUD_RATES
+    ({}, {'baud_rates': None}, 115200),
+])
+def test_negotiated_rate_carries_a_load(hex_file, port_options, device_options, expected):
+    port = SimulatedPort(SimulatedDevice(**device_options), busy=True, **port_options)
+    blt = create_blt(port)
+    assert blt.device_identified
+
+    assert blt.negotiate_baudrate() == expected
+    assert blt.baudrate == expected
+    assert port.baudrate == expected
+
+    assert erase_device(blt)
+    assert load_hex(blt, hex_file)
+    assert verify_hex(blt, hex_file)
+
+    blt.end_thread()
+
+
+def test_host_rates_limit_negotiation():
+    blt = create_blt(SimulatedPort())
+    assert blt.device_identified
+
+    assert blt.negotiate_baudrate(baud_rates=(115200, 230400)) == 230400
+
+    blt.end_thread()
@@ -0,0 +1,63 @@
+import pytest
+
+from booty.comm_thread import BootLoaderThread, ERASE_PAGE, BLANK_CHECK
+from booty.simulator import SimulatedPort, SimulatedDevice
+from booty.timing import TimingProfile
+from booty.util import erase_device, erase_addresses, blank_pages
+
+# the last word of the page at 0x1400, which is otherwise blank
+DIRTY_WORD = 0x17fe
+
+
+def _count_commands(port):
+    counts = {ERASE_PAGE: 0, BLANK_CHECK: 0}
+    handle = port.device.handle
+
+    def counting_handle(message):
+        if message[0] in counts:
+            counts[message[0]] += 1
+        return handle(message)
+
+    port.device.handle = counting_handle
+    return counts
+
+
+@pytest.mark.parametrize('blank_check, erase_delay, erased', [
+    (True, None, 1),
+    # reading the rows of a page is quicker than a slow erase, so pages are read instead
+    (False, 0.1, 1),
+    # reading is slower than erasing, so every page is erased
+    (False, None, None),
+])
+def test_skip_blank_erases_only_dirty_pages(blank_check, erase_delay, erased):
+    port = SimulatedPort(SimulatedDevice(blank_check=blank_check), baudrate=921600)
+    port.device.flash[DIRTY_WORD] = 0x000000
+    timing = TimingProfile(fixed={'erase_page': erase_delay} if erase_delay else None)
+    blt = BootLoaderThread(port, timing=timing)
+    assert blt.device_identified
+
+    pages = list(erase_addresses(blt))
+    counts = _count_commands(port)
+    assert erase_device(blt, skip_blank=True)
+
+    assert counts[ERASE_PAGE] == (erased if erased is not None else len(pages))
+    assert port.device.read_opcode(DIRTY_WORD) == 0xffffff
+    assert blt.blank_check_supported is blank_check
+
+    blt.end_thread()
+
+
+def test_mirror_knows_erased_pages_are_blank():
+    port = SimulatedPort(baudrate=921600)
+    blt = BootLoaderThread(port, timing_directory=None)
+    assert blt.device_identified
+    assert erase_device(blt)
+
+    counts = _count_commands(port)
+    pages = list(erase_addresses(blt))
+    assert blank_pages(blt, pages) == set(pages)
+    assert erase_device(blt, skip_blank=True)
+
+    assert counts == {ERASE_PAGE: 0, BLANK_CHECK: 0}
+
+    blt.end_thread()
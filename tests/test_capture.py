@@ -0,0 +1,43 @@
+from booty.capture import CapturePort, ReplayPort, read_capture, READ, WRITE
+from booty.simulator import SimulatedPort
+from booty.util import create_blt, erase_device, load_hex, verify_hex
+
+
+def _session(port, hex_file):
+    blt = create_blt(port)
+    assert blt.device_identified
+
+    assert erase_device(blt)
+    assert load_hex(blt, hex_file)
+    result = verify_hex(blt, hex_file)
+
+    blt.end_thread()
+    return result
+
+
+def test_replay_of_captured_session(tmp_path, hex_file):
+    path = str(tmp_path / 'session.cap')
+    port = CapturePort(SimulatedPort(baudrate=921600), path)
+    assert _session(port, hex_file)
+    port.close()
+
+    baudrate, records = read_capture(path)
+    assert baudrate == 921600
+    assert {direction for direction, _, _ in records} == {READ, WRITE}
+    assert all(a[1] <= b[1] for a, b in zip(records, records[1:]))
+
+    # the replayed responses lead the host through the same session without a device
+    replay = ReplayPort(path)
+    assert _session(replay, hex_file)
+    assert replay.finished
+
+
+def test_replay_releases_responses_only_after_their_commands(tmp_path, hex_file):
+    path = str(tmp_path / 'session.cap')
+    port = CapturePort(SimulatedPort(baudrate=921600), path)
+    assert _session(port, hex_file)
+    port.close()
+
+    replay = ReplayPort(path)
+    assert replay.in_waiting == 0
+    assert replay.read(16) == b''
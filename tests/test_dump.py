@@ -0,0 +1,69 @@
+import pytest
+
+from booty.comm_thread import READ_MAX
+from booty.hex import HexParser
+from booty.simulator import SimulatedPort
+from booty.util import create_blt, erase_device, load_hex, dump_flash
+
+
+@pytest.fixture
+def loaded(hex_file):
+    port = SimulatedPort(baudrate=921600)
+    blt = create_blt(port)
+    assert blt.device_identified
+    assert erase_device(blt)
+    assert load_hex(blt, hex_file)
+    blt.clear_memory_map()
+
+    yield port, blt
+    blt.end_thread()
+
+
+def test_dump_to_hex_and_bin(tmp_path, loaded):
+    port, blt = loaded
+    hex_path, bin_path = str(tmp_path / 'dump.hex'), str(tmp_path / 'dump.bin')
+
+    assert dump_flash(blt, hex_path)
+    assert dump_flash(blt, bin_path)
+
+    dumped = HexParser(hex_path)
+    with open(bin_path, 'rb') as f:
+        data = f.read()
+    # whole rows are read, up to the end of the row holding the last address
+    row_size = blt.max_prog_size * 2
+    assert len(data) == -(-blt.prog_length // row_size) * row_size * 2
+
+    for address in range(0, blt.prog_length, 2):
+        expected = port.device.read_opcode(address)
+        assert dumped.get_opcode(address) & 0xffffff == expected
+        assert int.from_bytes(data[address * 2:address * 2 + 4], 'little') == expected
+
+
+def test_lost_rows_are_read_again(tmp_path, loaded):
+    port, blt = loaded
+
+    # every seventh read of the first hundred goes unanswered
+    handle = port.device.handle
+    reads = []
+
+    def drop_some_reads(message):
+        if message[0] == READ_MAX:
+            reads.append(message)
+            if len(reads) % 7 == 0 and len(reads) < 100:
+                return None
+        return handle(message)
+
+    port.device.handle = drop_some_reads
+
+    path = str(tmp_path / 'dump.hex')
+    assert dump_flash(blt, path)
+    assert len(reads) > blt.prog_length // (blt.max_prog_size * 2)
+
+    dumped = HexParser(path)
+    for address in range(0x1000, 0x1800, 2):
+        assert dumped.get_opcode(address) & 0xffffff == address * 3
+
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        dump_flash(None, str(tmp_path / 'dump.txt'))
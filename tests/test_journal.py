@@ -0,0 +1,64 @@
+import time
+
+import serial
+
+from booty.comm_thread import BootLoaderThread
+from booty.journal import journaled_load
+from booty.simulator import SimulatedPort
+from booty.util import erase_addresses, write_addresses, verify_hex
+
+
+class DroppingPort(SimulatedPort):
+    """
+    A simulated port which fails like an unplugged cable after a number of writes
+    """
+    def __init__(self, device=None):
+        super().__init__(device)
+        self.remaining = None
+
+    def write(self, data):
+        if self.remaining is not None:
+            if self.remaining == 0:
+                raise serial.SerialException('device disconnected')
+            self.remaining -= 1
+
+        return super().write(data)
+
+
+def test_journaled_load_stops_when_port_fails(tmp_path, hex_file):
+    port = DroppingPort()
+    blt = BootLoaderThread(port, timing_directory=None)
+    assert blt.device_identified
+
+    port.remaining = 25
+    start_time = time.time()
+    assert not journaled_load(blt, hex_file, str(tmp_path / 'journal'))
+
+    assert time.time() - start_time < 10.0
+    assert isinstance(blt.error, serial.SerialException)
+    assert not blt.alive
+    assert not blt.busy
+
+
+def test_first_write_is_checked_on_resume(tmp_path, hex_file):
+    port = DroppingPort()
+    blt = BootLoaderThread(port, timing_directory=None)
+    assert blt.device_identified
+
+    # the port fails on the first write, after every erase has been recorded
+    port.remaining = len(list(erase_addresses(blt)))
+    assert not journaled_load(blt, hex_file, str(tmp_path / 'journal'))
+
+    # the row was partially programmed when the station went down
+    first_write = next(write_addresses(blt))
+    port.device.flash[first_write + 2] = 0x123456
+
+    blt = BootLoaderThread(DroppingPort(port.device), timing_directory=None)
+    assert blt.device_identified
+    assert journaled_load(blt, hex_file, str(tmp_path / 'journal'))
+
+    assert port.device.read_opcode(first_write + 2) == 0xffffff
+    assert verify_hex(blt, hex_file)
+    assert not list((tmp_path / 'journal').glob('*.journal'))
+
+    blt.end_thread()
@@ -0,0 +1,51 @@
+from booty.mirror import FlashMirror
+from booty.simulator import SimulatedPort, SimulatedDevice
+from booty.util import create_blt, erase_device, identify_device
+
+
+def test_erase_and_write_replace_confirmed_contents():
+    mirror = FlashMirror()
+    mirror.filled(0x1000, [0x123456, 0x654321])
+    assert mirror.confirmed(0x1000, 2)
+
+    mirror.erased(0x1000, 4)
+    assert not mirror.confirmed(0x1000, 1)
+    assert mirror.blank(0x1000, 4)
+
+    mirror.written(0x1000, [0x00ff00])
+    assert mirror.get(0x1000) is None
+    assert mirror.get(0x1000, expected=True) == 0x00ff00
+    assert not mirror.blank(0x1000, 4)
+
+
+def test_unknown_write_forgets_contents():
+    mirror = FlashMirror()
+    mirror.erased(0x1000, 4)
+    mirror.forget(0x1000, 2)
+
+    assert mirror.get(0x1000, expected=True) is None
+    assert mirror.get(0x1004, expected=True) == 0xffffff
+
+    # programming unknown contents leaves them unknown
+    mirror.written(0x1000, [0x000000])
+    assert mirror.get(0x1000, expected=True) is None
+
+
+def test_new_board_is_not_trusted_to_be_blank():
+    port = SimulatedPort()
+    blt = create_blt(port)
+    assert blt.device_identified
+    assert erase_device(blt)
+    assert blt.mirror.blank(0x1000, blt.page_length)
+
+    # another board with contents in the application space is connected
+    port.device = SimulatedDevice()
+    port.device.flash[0x1000] = 0x123456
+    blt.reset_identification()
+    assert identify_device(blt)
+    assert not blt.mirror.blank(0x1000, blt.page_length)
+
+    assert erase_device(blt, skip_blank=True)
+    assert port.device.read_opcode(0x1000) == 0xffffff
+
+    blt.end_thread()
@@ -0,0 +1,37 @@
+import pytest
+
+from booty.comm_thread import ERASE_PAGE, WRITE_MAX
+from booty.simulator import SimulatedPort
+from booty.util import create_blt, erase_and_load, verify_hex, _overlapped_schedule
+
+
+def test_next_page_is_erased_ahead_of_the_rows():
+    writes = [(WRITE_MAX, address, [], 0.0) for address in (0x400, 0x500, 0x800)]
+    schedule = [(command, address) for command, address, _, _ in
+                _overlapped_schedule([0x000, 0x400, 0x800, 0xc00], writes, 0x400)]
+
+    assert schedule == [
+        (ERASE_PAGE, 0x000), (ERASE_PAGE, 0x400), (ERASE_PAGE, 0x800),
+        (WRITE_MAX, 0x400), (WRITE_MAX, 0x500),
+        (ERASE_PAGE, 0xc00),
+        (WRITE_MAX, 0x800),
+    ]
+
+
+@pytest.mark.parametrize('baudrate', [115200, 921600])
+@pytest.mark.parametrize('skip_blank', [False, True])
+def test_overlapped_erase_and_load(hex_file, baudrate, skip_blank):
+    port = SimulatedPort(baudrate=baudrate, busy=True)
+    blt = create_blt(port)
+    assert blt.device_identified
+
+    # stale contents within the image and in a page which the image does not use
+    port.device.flash[0x1010] = 0x000000
+    port.device.flash[0x4000] = 0x000000
+
+    assert erase_and_load(blt, hex_file, skip_blank=skip_blank)
+    assert verify_hex(blt, hex_file)
+    assert port.device.read_opcode(0x4000) == 0xffffff
+    assert port.dropped == 0
+
+    blt.end_thread()
@@ -0,0 +1,50 @@
+import pytest
+
+from booty.package import prepare_image, profile_from_boot_loader, load_prepared
+from booty.simulator import SimulatedPort
+from booty.util import create_blt, verify_hex
+
+# a word within the hex file, a word of a blank row of the application space and a word of the user ID area
+PATCHES = {0x1100: 0x00abcd, 0x2000: 0x000123, 0x800ff8: 0x000042}
+
+
+@pytest.fixture
+def blt():
+    blt = create_blt(SimulatedPort(baudrate=921600))
+    assert blt.device_identified
+    yield blt
+    blt.end_thread()
+
+
+def test_patched_image_round_trip(blt, hex_file):
+    image = prepare_image(hex_file, profile_from_boot_loader(blt), blt.timing)
+    patched = image.patched(PATCHES)
+
+    # only the rows holding patched words are framed again, while the user ID is written after the image
+    changed = [new for old, new in zip(image.entries, patched.entries) if old is not new]
+    assert [address for _, address, _, _, _ in changed] == [0x1100, 0x2000]
+    assert len(patched) == len(image) + 1
+    assert patched.entries[-1][1] == 0x800ff8
+
+    assert load_prepared(blt, patched)
+    assert blt.port.device.flash[0x1100] == 0x00abcd
+    assert blt.port.device.flash[0x2000] == 0x000123
+    assert blt.port.device.flash[0x800ff8] == 0x000042
+
+    assert verify_hex(blt, hex_file, overrides=PATCHES)
+
+
+def test_wrong_patch_fails_verification(blt, hex_file):
+    image = prepare_image(hex_file, profile_from_boot_loader(blt), blt.timing)
+    assert load_prepared(blt, image.patched(PATCHES))
+
+    blt.clear_memory_map()
+    assert not verify_hex(blt, hex_file, overrides={**PATCHES, 0x2000: 0x000124})
+    assert not verify_hex(blt, hex_file)
+
+
+def test_patch_within_boot_loader_is_refused(blt, hex_file):
+    image = prepare_image(hex_file, profile_from_boot_loader(blt), blt.timing)
+
+    with pytest.raises(ValueError, match='boot loader'):
+        image.patched({0x800: 0x000000})
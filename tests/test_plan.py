@@ -0,0 +1,75 @@
+import pytest
+from intelhex import IntelHex
+
+from booty.comm_thread import WRITE_ROW, WRITE_MAX
+from booty.package import profile_from_processor
+from booty.simulator import SimulatedPort
+from booty.util import create_blt, erase_device, load_hex, verify_hex, iter_writes, plan_writes
+
+PROFILE = profile_from_processor('dspic33ep32mc204')
+
+
+@pytest.fixture
+def sparse_hex(tmp_path):
+    """
+    A full region of 128 opcodes at 0x1000, a single word at 0x1100 and three rows of 2 opcodes with data at 0x1200
+    """
+    words = {address: address for address in range(0x1000, 0x1100, 2)}
+    words.update({0x1100: 0x001234, 0x1200: 0x000001, 0x1204: 0x000002, 0x1208: 0x000003})
+
+    ih = IntelHex()
+    for address, opcode in words.items():
+        for i, b in enumerate(opcode.to_bytes(4, 'little')):
+            ih[(address << 1) + i] = b
+
+    path = tmp_path / 'sparse.hex'
+    ih.write_hex_file(str(path))
+    return str(path)
+
+
+def _commands(writes):
+    return [(command, address) for command, address, _, _ in writes]
+
+
+@pytest.mark.parametrize('baudrate, expected', [
+    # a WRITE_ROW costs more than a third of a WRITE_MAX
+    (115200, [(WRITE_MAX, 0x1000), (WRITE_ROW, 0x1100), (WRITE_MAX, 0x1200)]),
+    # and less than a third at the faster rate
+    (921600, [(WRITE_MAX, 0x1000), (WRITE_ROW, 0x1100),
+              (WRITE_ROW, 0x1200), (WRITE_ROW, 0x1204), (WRITE_ROW, 0x1208)]),
+])
+def test_commands_are_chosen_by_cost(sparse_hex, baudrate, expected):
+    assert _commands(iter_writes(PROFILE, sparse_hex, baudrate)) == expected
+
+    plan = plan_writes(PROFILE, sparse_hex, baudrate)
+    assert _commands(plan) == expected
+    assert plan.cost < plan.full_cost
+
+
+def test_ranges_limit_the_plan(sparse_hex):
+    assert _commands(iter_writes(PROFILE, sparse_hex, ranges=[(0x1400, 0x1800)])) == []
+
+
+@pytest.mark.parametrize('baudrate', [115200, 921600])
+def test_planned_load(sparse_hex, baudrate):
+    port = SimulatedPort(baudrate=baudrate)
+    blt = create_blt(port)
+    assert blt.device_identified
+
+    commands = []
+    handle = port.device.handle
+
+    def recording_handle(message):
+        if message[0] in (WRITE_ROW, WRITE_MAX):
+            commands.append(message[0])
+        return handle(message)
+
+    port.device.handle = recording_handle
+
+    assert erase_device(blt)
+    assert load_hex(blt, sparse_hex)
+    assert verify_hex(blt, sparse_hex)
+
+    assert commands == [command for command, _, _, _ in iter_writes(blt, sparse_hex, baudrate, blt.timing)]
+
+    blt.end_thread()
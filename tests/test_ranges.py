@@ -0,0 +1,49 @@
+import pytest
+
+from booty.package import profile_from_processor
+from booty.simulator import SimulatedPort
+from booty.util import create_blt, erase_device, load_hex, verify_hex, parse_range, range_pages, \
+    erase_addresses, write_addresses
+
+PROFILE = profile_from_processor('dspic33ep32mc204')
+
+
+def test_parse_range():
+    assert parse_range('0x1000:0x1400') == (0x1000, 0x1400)
+    assert parse_range('4096:5120') == (0x1000, 0x1400)
+
+    for text in ('0x1000', '0x1400:0x1000', 'start:end'):
+        with pytest.raises(ValueError):
+            parse_range(text)
+
+
+def test_range_pages_cover_ranges_within_application_space():
+    # pages of 0x400 addresses; the application space starts at 0x1000
+    assert range_pages(PROFILE, [(0x1010, 0x1020)]) == [0x1000]
+    assert range_pages(PROFILE, [(0x13fe, 0x1402), (0x1000, 0x1002)]) == [0x1000, 0x1400]
+    assert range_pages(PROFILE, [(0x0000, 0x1400)]) == [0x0000, 0x1000]
+
+    assert list(erase_addresses(PROFILE, [(0x1400, 0x1800)])) == [0x1400]
+    assert list(write_addresses(PROFILE, [(0x1400, 0x1800)])) == [0x1400, 0x1500, 0x1600, 0x1700]
+
+
+def test_range_load_leaves_other_pages_untouched(hex_file):
+    port = SimulatedPort(baudrate=921600)
+    blt = create_blt(port)
+    assert blt.device_identified
+    assert erase_device(blt)
+    assert load_hex(blt, hex_file)
+
+    # a word outside of the range differs from the image, and a word within it has been corrupted
+    port.device.flash[0x1000] = 0x000000
+    port.device.flash[0x1400] = 0x000000
+
+    ranges = [(0x1400, 0x1800)]
+    assert erase_device(blt, ranges=ranges)
+    assert load_hex(blt, hex_file, ranges=ranges)
+    assert verify_hex(blt, hex_file, ranges=ranges)
+
+    assert port.device.read_opcode(0x1000) == 0x000000
+    assert port.device.read_opcode(0x1400) == 0x1400 * 3
+
+    blt.end_thread()
@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+import serial
+
+from booty.server import FlashServer, create_server
+from booty.simulator import SimulatedPort
+
+
+@pytest.fixture
+def jobs_url():
+    flash_server = FlashServer(port_factory=lambda port, baudrate: None)
+    httpd = create_server('127.0.0.1', 0, flash_server)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    yield 'http://127.0.0.1:{}/jobs'.format(httpd.server_address[1])
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _post(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode('utf-8'), {'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+@pytest.mark.parametrize('body', [
+    {'port': 'sim', 'operations': 'erase'},
+    {'port': 'sim', 'operations': ['erase'], 'patches': [1]},
+    {'port': 'sim', 'operations': ['erase'], 'patches': {'0x800ff8': [1]}},
+    {'operations': ['erase']},
+    ['erase'],
+])
+def test_invalid_jobs_are_rejected(jobs_url, body):
+    status, response = _post(jobs_url, body)
+
+    assert status == 400
+    assert 'error' in response
+
+
+class UnpluggablePort(SimulatedPort):
+    """
+    A simulated port whose writes fail while it is unplugged
+    """
+    unplugged = False
+
+    def write(self, data):
+        if UnpluggablePort.unplugged:
+            raise serial.SerialException('device disconnected')
+
+        return super().write(data)
+
+
+def _wait(job, timeout=10.0):
+    start_time = time.time()
+    while job.status in ('queued', 'running') and time.time() - start_time < timeout:
+        time.sleep(0.05)
+
+    return job.status
+
+
+def test_device_is_reopened_after_port_failure():
+    ports = []
+
+    def port_factory(port, baudrate):
+        ports.append(UnpluggablePort(baudrate=baudrate))
+        return ports[-1]
+
+    flash_server = FlashServer(port_factory=port_factory)
+    assert _wait(flash_server.submit('sim', ['erase'])) == 'succeeded'
+
+    UnpluggablePort.unplugged = True
+    try:
+        assert _wait(flash_server.submit('sim', ['erase'])) == 'failed'
+    finally:
+        UnpluggablePort.unplugged = False
+
+    job = flash_server.submit('sim', ['erase'])
+    assert _wait(job) == 'succeeded'
+    assert job.results == {'erase': True}
+    assert len(ports) == 2
+
+    flash_server.shutdown()
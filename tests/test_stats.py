@@ -0,0 +1,51 @@
+import time
+
+from booty.comm_thread import BootLoaderThread, address_command, READ_MAX, READ_BAUD_RATES, RESPONSE_TIMEOUT
+from booty.simulator import SimulatedPort, SimulatedDevice
+
+
+def test_lost_response_is_counted_as_timeout():
+    port = SimulatedPort(SimulatedDevice(baud_rates=()))
+    blt = BootLoaderThread(port, timing_directory=None)
+    assert blt.device_identified
+
+    # the first read is lost; the second is answered
+    handle = port.device.handle
+    lost = []
+
+    def drop_first_read(message):
+        if message[0] == READ_MAX and not lost:
+            lost.append(message)
+            return None
+        return handle(message)
+
+    port.device.handle = drop_first_read
+    blt.read_page(0x1000)
+    blt.read_page(0x1100)
+    blt.query_baud_rates()
+
+    time.sleep(RESPONSE_TIMEOUT + 0.3)
+
+    assert blt.stats.timeouts == {READ_MAX: 1, READ_BAUD_RATES: 1}
+    assert blt.stats.round_trips[READ_MAX].count == 1
+    assert blt.stats.round_trips[READ_MAX].maximum < RESPONSE_TIMEOUT
+    assert not blt._pending_responses
+
+    blt.end_thread()
+
+
+def test_round_trip_excludes_remainder_of_wait():
+    port = SimulatedPort(baudrate=921600)
+    blt = BootLoaderThread(port, timing_directory=None, max_batch=8)
+    assert blt.device_identified
+
+    # a wait far longer than the device takes to answer
+    for address in range(0x1000, 0x2000, 0x100):
+        blt.add_to_queue(address_command(READ_MAX, address), 0.05, address=address)
+    while blt.busy:
+        time.sleep(0.01)
+
+    assert blt.stats.round_trips[READ_MAX].count == 16
+    assert blt.stats.round_trips[READ_MAX].maximum < 0.04
+
+    blt.end_thread()
@@ -0,0 +1,101 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from booty.transport import open_port, CoalescingPort, SocketPort
+
+
+class LoopbackServer:
+    """
+    A local TCP server which accepts a single connection and echoes it back,
+    or resets it once the first data has arrived
+    """
+    def __init__(self, reset=False):
+        self.reset = reset
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self.port = self._server.getsockname()[1]
+
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        connection, _ = self._server.accept()
+
+        if self.reset:
+            connection.recv(4096)
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            connection.close()
+            return
+
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            connection.sendall(data)
+        connection.close()
+
+    def close(self):
+        self._server.close()
+
+
+def _read(port, size, timeout=2.0):
+    data = b''
+    start_time = time.time()
+    while len(data) < size and time.time() - start_time < timeout:
+        data += port.read(size - len(data))
+        time.sleep(0.001)
+    return data
+
+
+def test_loopback_round_trip():
+    server = LoopbackServer()
+    port = open_port('tcp://127.0.0.1:{}'.format(server.port))
+    assert isinstance(port, CoalescingPort)
+
+    frames = [bytes([0xf7, i, 0x7f]) for i in range(100)]
+    for frame in frames:
+        assert port.write(frame) == len(frame)
+    port.flush()
+
+    assert _read(port, 300) == b''.join(frames)
+
+    port.close()
+    server.close()
+
+
+def test_peer_disconnect_raises():
+    server = LoopbackServer(reset=True)
+    port = CoalescingPort(SocketPort('127.0.0.1', server.port))
+
+    with pytest.raises(OSError):
+        start_time = time.time()
+        while time.time() - start_time < 5.0:
+            port.write(b'\x00' * 1024)
+            time.sleep(0.01)
+
+    # the failure is reported again instead of waiting on the stopped writer
+    with pytest.raises(OSError):
+        port.flush()
+
+    start_time = time.time()
+    with pytest.raises(OSError):
+        port.close()
+    assert time.time() - start_time < 1.0
+
+    server.close()
+
+
+def test_socket_port_write_after_close():
+    server = LoopbackServer()
+    port = SocketPort('127.0.0.1', server.port)
+    port.close()
+
+    with pytest.raises(OSError):
+        port.write(b'\x00')
+
+    server.close()